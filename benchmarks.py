@@ -0,0 +1,253 @@
+"""
+Benchmarks of the project manager's hot paths, run against synthetic fixtures.
+
+    python benchmarks.py [--repos N] [--commits M] [--projects K] [--cards C] [--repeat R] [--output FILE]
+
+The fixtures are built in a temporary directory:
+ - N git repositories of M commits each.
+ - A database with K projects (the first N of them are the repositories) and a board of C cards.
+Each benchmark is then timed R times. The results are printed as JSON, or written to FILE, along with
+the commit they were measured at and the fixture sizes. Runs at two commits can be compared directly.
+Fixtures are seeded, so the same arguments always build the same fixtures.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+GIT_ENV = {**os.environ, "GIT_CONFIG_NOSYSTEM": "1", "GIT_CONFIG_GLOBAL": os.devnull, "LC_ALL": "C"}
+AUTHORS = ["Ada <ada@example.com>", "Grace <grace@example.com>", "Linus <linus@example.com>"]
+
+
+def git(location, *args, stdin=None):
+    return subprocess.run(['git', *args], cwd=location, env=GIT_ENV, input=stdin, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT).stdout
+
+
+def make_repo(location, commits, rng):
+    """ a git repository with a history of `commits` commits over the last year, made with fast-import. """
+    os.makedirs(location)
+    git(location, 'init', '-q')
+    branch = git(location, 'symbolic-ref', 'HEAD').decode('utf-8').strip()
+
+    now = int(time.time())
+    timestamps = sorted(now - rng.randrange(365 * 24 * 60 * 60) for _ in range(commits))
+    stream = []
+    for i, timestamp in enumerate(timestamps):
+        author = rng.choice(AUTHORS)
+        message = f"commit {i}\n".encode('utf-8')
+        contents = f"line {i}\n".encode('utf-8') * (i % 7 + 1)
+        stream += [
+            f"commit {branch}\n".encode('utf-8'),
+            f"author {author} {timestamp} +0000\n".encode('utf-8'),
+            f"committer {author} {timestamp} +0000\n".encode('utf-8'),
+            f"data {len(message)}\n".encode('utf-8'), message,
+            f"M 644 inline file_{i % 10}.py\n".encode('utf-8'),
+            f"data {len(contents)}\n".encode('utf-8'), contents, b"\n",
+        ]
+    git(location, 'fast-import', '--quiet', stdin=b"".join(stream))
+    git(location, 'reset', '-q', '--hard')
+
+    # a few repositories with local changes, so not every status is clean.
+    if rng.random() < 0.5:
+        with open(os.path.join(location, "untracked.txt"), 'w') as untracked:
+            untracked.write("untracked\n")
+
+
+def make_fixtures(root, repos, commits, projects, cards, seed=0):
+    """ build the fixtures under root, which must be the working directory (db_file is relative to it). """
+    from database_api import DatabaseObject, db_file
+    from project_board.project_board import Card, ProjectBoard, ProjectLabels
+
+    rng = random.Random(seed)
+    locations = []
+    for i in range(projects):
+        location = os.path.join(root, "projects", f"project_{i}")
+        if i < repos:
+            make_repo(location, commits, rng)
+        else:
+            os.makedirs(location)
+        locations.append(location)
+
+    with DatabaseObject(db_file, force_reset=True) as dbo:
+        for category in ["Work", "School", "Personal"]:
+            dbo.register_category(category)
+        dbo.register_projects([{"project_name": os.path.basename(location), "project_location": location,
+                                "category_id": i % 3 + 1} for i, location in enumerate(locations)])
+
+    labels = list(ProjectLabels.labels.keys())
+    board = ProjectBoard("benchmark board")
+    board.add_list("In Progress")
+    list_names = list(board.lists.keys())
+    for i in range(cards):
+        card_labels = ProjectLabels(*rng.sample(labels, rng.randint(0, 3)))
+        board.add_card(list_names[i % len(list_names)], Card(f"card {i}", f"contents of card {i}", card_labels))
+    board.save(db_file)
+    return locations, board
+
+
+def time_it(func, repeat, setup=None):
+    """ timings of func in milliseconds, setup (if any) is run untimed before each call. """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return {
+        "runs": repeat,
+        "min_ms": round(min(times), 3),
+        "median_ms": round(statistics.median(times), 3),
+        "mean_ms": round(statistics.fmean(times), 3),
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=PACKAGE_DIR, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, check=True).stdout.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(repos, commits, projects, cards, repeat, seed=0):
+    """ build the fixtures in a temporary directory and time every benchmark, :returns: {name: timings} """
+    from database_api import DatabaseObject, db_file, make_project_row
+    from git_status import StatusCache, StatusMemo, iter_statuses
+    from project_board.project_board import ProjectBoard, ProjectLabels
+    from project_watcher import ProjectWatcher
+    from view_model import PanelViewModel
+    import gitlog
+
+    results = {}
+    cwd = os.getcwd()
+    root = tempfile.mkdtemp(prefix="pmk_benchmarks_")
+    try:
+        os.chdir(root)
+        fixtures = []
+        results["fixtures.build"] = time_it(
+            lambda: fixtures.append(make_fixtures(root, repos, commits, projects, cards, seed)), 1)
+        locations, board = fixtures[0]
+        gitlog.get_git_projects.invalidate()
+
+        # the command line status listing.
+        try:
+            import cmd_line_file
+        except ImportError as error:
+            print(f"skipping mainloop_status: {error}", file=sys.stderr)
+        else:
+            def mainloop_status():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    cmd_line_file.mainloop_status()
+            results["cmd_line_file.mainloop_status"] = time_it(mainloop_status, repeat)
+
+        results["git_status.iter_statuses"] = time_it(lambda: list(iter_statuses(locations)), repeat)
+        with ProjectWatcher() as watcher:
+            memo = StatusMemo(watcher)
+            list(memo.iter_statuses(locations))
+            results["git_status.StatusMemo.iter_statuses"] = time_it(lambda: list(memo.iter_statuses(locations)),
+                                                                     repeat)
+
+        # commit activity, the first call indexes every commit.
+        results["gitlog.get_git_log_summary.cold"] = time_it(gitlog.get_git_log_summary, 1)
+        results["gitlog.get_git_log_summary"] = time_it(gitlog.get_git_log_summary, repeat)
+        results["gitlog.plot_git_activity"] = time_it(gitlog.plot_git_activity, repeat)
+
+        # database reads and writes.
+        def get_projects():
+            with DatabaseObject(db_file) as dbo:
+                dbo.get_projects()
+                dbo.get_categories()
+        results["database_api.get_projects"] = time_it(get_projects, repeat)
+
+        scratch_file = os.path.join(root, "scratch", "cms.db")
+        rows = [{"project_name": f"scratch_{i}", "project_location": location}
+                for i, location in enumerate(locations)]
+
+        def clear_scratch():
+            with DatabaseObject(scratch_file) as dbo:
+                dbo.conn.execute("DELETE FROM projects;")
+
+        def register_projects():
+            with DatabaseObject(scratch_file) as dbo:
+                dbo.register_projects(rows)
+        results["database_api.register_projects"] = time_it(register_projects, repeat, setup=clear_scratch)
+        results["database_api.make_project_row"] = time_it(
+            lambda: [make_project_row(**row) for row in rows], repeat)
+
+        # label filters, on the board in memory and on a board loaded lazily from the database.
+        bug_fix = ProjectLabels("Bug Fix")
+        results["ProjectBoard.filter_by_label.memory"] = time_it(
+            lambda: board.filter_by_label(bug_fix, exact=False), repeat)
+        results["ProjectBoard.filter_by_label.database"] = time_it(
+            lambda: ProjectBoard.load(board.name, db_file).filter_by_label(bug_fix, exact=False), repeat)
+        results["ProjectBoard.load_all_lists"] = time_it(
+            lambda: ProjectBoard.load(board.name, db_file).lists.values(), repeat)
+
+        # the data each GUI frame needs, without drawing it.
+        status_cache = StatusCache()
+        view_model = PanelViewModel(db_file, status_cache)
+        status_cache.set_locations(locations)
+        status_cache.refresh()
+
+        def frame_rebuild():
+            view_model.invalidate()
+            view_model.update()
+            view_model.project_list()
+
+        def frame_steady():
+            view_model.update()
+            view_model.project_list()
+        results["frame.rebuild"] = time_it(frame_rebuild, repeat)
+        results["frame.steady"] = time_it(frame_steady, repeat)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the hot paths of the project manager on synthetic fixtures.")
+    parser.add_argument("--repos", type=int, default=20, help="git repositories to create")
+    parser.add_argument("--commits", type=int, default=200, help="commits in each repository")
+    parser.add_argument("--projects", type=int, default=200, help="projects to register, at least --repos")
+    parser.add_argument("--cards", type=int, default=10000, help="cards on the board")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write the results to, instead of stdout")
+    args = parser.parse_args()
+
+    params = {"repos": args.repos, "commits": args.commits, "projects": max(args.projects, args.repos),
+              "cards": args.cards, "repeat": args.repeat, "seed": args.seed}
+    report = {
+        "commit": current_commit(),
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "results": run_benchmarks(**params),
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as output:
+            output.write(text + "\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,61 +5,51 @@ import shlex
 
 from PyInquirer import prompt as prompt
 from database_api import DatabaseObject, db_file
+from git_status import iter_statuses, StatusMemo
+import git_jobs
 from prompt_toolkit.validation import Validator, ValidationError
-import subprocess
+from prompt_toolkit.completion import Completer, Completion
 import re
 import os.path
-import json
-import pandas as pd
-
-with DatabaseObject(db_file) as dbo:
-    categories = dbo.get_categories()
+from lazy_state import lazy_state
+from name_index import PrefixTrie, ProjectNameIndex
+import line_counter
+from project_watcher import ProjectWatcher
+from project_config import load_configs, settings_text
+import project_discovery
+import instrumentation
+import sys
 
 # commands we can call from the CMD line tool
-registered_functions = ["git", "status", "register", "remove", "update", "help"]
+registered_functions = ["git", "status", "discover", "register", "remove", "update", "help"]
 # valid exit commands:
 exit_ = ['q', 'quit', 'exit']
+# git commands the main loop can run on projects
+git_commands = ['commit', 'pull', 'push', 'status']
 
+command_trie = PrefixTrie(registered_functions + exit_)
+git_command_trie = PrefixTrie(git_commands)
+# registered project names, for validation and completion on every keystroke.
+project_names = ProjectNameIndex(db_file)
 
-def gst(location, raw=False):
-    """ get the git status of a project """
-    cwd = os.getcwd()
-    os.chdir(location)
-    res = subprocess.getoutput('git status')
-    os.chdir(cwd)
-
-    if raw:
-        return res
-
-    gst_bits = set()
-
-    status_markers = ["modified:", "Untracked files", "Your branch is ahead of", "new file:", "renamed:", "deleted:"]
-    for line in res.split("\n"):
-        for key, grep in zip(list("!?*+>x"), status_markers):
-            if grep in line:
-                gst_bits.add(key)
-
-    return "".join(gst_bits)
 
+@lazy_state
+def get_categories():
+    """ {category_id: category_name}, looked up on first use. refresh with get_categories.refresh() """
+    with DatabaseObject(db_file) as _dbo:
+        return _dbo.get_categories()
 
-def git_func(location, function, flags=None, *args):
-    # commit, pull, push
-    assert function in ['commit', 'pull', 'push']
-    args = list(map(lambda x: x.replace('"', '\"').replace('\\', '\\').join(["\"", "\""]), args))
 
-    output_lst = ['git', function]
-    if flags:
-        output_lst.append(f"-{flags}")
-    if args:
-        output_lst += args
+def __getattr__(name):
+    if name == "categories":
+        return get_categories()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-    cmd = " ".join(output_lst)
-    cwd = os.getcwd()
-    os.chdir(location)
-    res = subprocess.getoutput(cmd)
-    os.chdir(cwd)
 
-    return res
+@lazy_state
+def get_status_memo():
+    """ statuses of the projects, only recomputed for projects that changed on disk since the last listing. """
+    return StatusMemo(ProjectWatcher().start())
 
 
 class FilepathValidator(Validator):
@@ -75,16 +65,11 @@ class FilepathValidator(Validator):
 class ProjectValidator(Validator):
     def validate(self, document):
         doc_text = document.text
-        with DatabaseObject(db_file) as _dbo:
-            projects = _dbo.get_projects()
-            for proj_row in projects:
-                if proj_row['project_name'] == doc_text.strip():
-                    break
-            else:
-                raise ValidationError(
-                    message="Please enter a valid project name.",
-                    cursor_position=len(doc_text)
-                )
+        if doc_text.strip() not in project_names:
+            raise ValidationError(
+                message="Please enter a valid project name.",
+                cursor_position=len(doc_text)
+            )
 
 
 class MainloopValidator(Validator):
@@ -99,8 +84,7 @@ class MainloopValidator(Validator):
         command = tokens.pop(0)
         post_command_argument = " ".join(tokens)
 
-        valid_commands = ['commit', 'pull', 'push', 'status']
-        if command not in valid_commands:
+        if command not in git_commands:
             raise ValidationError(message=f"unknown git command {repr(command)}", cursor_position=len(document.text))
 
         if post_command_argument.strip():
@@ -116,16 +100,11 @@ class MainloopValidator(Validator):
         :param needs_exist: If True, raises ValidationError on the project not existing, and if False, the reverse.
         """
         # need to check if the argument is a project.
-        with DatabaseObject(db_file) as _dbo:
-            for row in _dbo.get_projects():
-                if row['project_name'] == project_name:
-                    if needs_exist:
-                        break
-                    else:
-                        raise ValidationError(message="invalid project name: exists", cursor_position=len(doc_text))
-            else:
-                if needs_exist:
-                    raise ValidationError(message="invalid project name: does not exist", cursor_position=len(doc_text))
+        if project_name in project_names:
+            if not needs_exist:
+                raise ValidationError(message="invalid project name: exists", cursor_position=len(doc_text))
+        elif needs_exist:
+            raise ValidationError(message="invalid project name: does not exist", cursor_position=len(doc_text))
 
     def validate(self, document):
         doc_text = document.text.strip()
@@ -150,6 +129,35 @@ class MainloopValidator(Validator):
         raise ValidationError(message=f"unknown command {first_token}", cursor_position=len(document.text))
 
 
+class MainloopCompleter(Completer):
+    """ tab completion of the main loop's commands, git commands and project names. """
+    def get_completions(self, document, complete_event):
+        tokens = document.text_before_cursor.lstrip().split(" ")
+
+        if len(tokens) == 1:
+            prefix = tokens[0]
+            words = command_trie.complete(prefix)
+        elif tokens[0] == 'git' and len(tokens) == 2:
+            prefix = tokens[1]
+            words = git_command_trie.complete(prefix)
+        elif tokens[0] == 'git' and tokens[1] in git_commands:
+            # project names may contain spaces.
+            prefix = " ".join(tokens[2:])
+            words = project_names.complete(prefix)
+        else:
+            return
+
+        for word in words:
+            yield Completion(word, start_position=-len(prefix))
+
+
+class ProjectNameCompleter(Completer):
+    def get_completions(self, document, complete_event):
+        prefix = document.text_before_cursor.lstrip()
+        for word in project_names.complete(prefix):
+            yield Completion(word, start_position=-len(prefix))
+
+
 project_registration_questions = [
     {
         'type': 'input',
@@ -176,7 +184,7 @@ project_registration_questions = [
         'type': 'list',
         'name': 'category',
         'message': 'Project Category',
-        'choices': [None] + [categories[i] for i in sorted(categories.keys())]
+        'choices': lambda _: [None] + [get_categories()[i] for i in sorted(get_categories().keys())]
     }
 ]
 project_deletion_questions = [
@@ -184,7 +192,8 @@ project_deletion_questions = [
         'type': 'input',
         'name': 'project_name',
         'message': 'Project Name:',
-        'validate': ProjectValidator
+        'validate': ProjectValidator,
+        'completer': ProjectNameCompleter()
     },
     {
         'type': 'input',
@@ -197,40 +206,49 @@ main_loop_prompt = [
         'type': 'input',
         'name': 'main_input',
         'message': '',
-        'validate': MainloopValidator
+        'validate': MainloopValidator,
+        'completer': MainloopCompleter()
     }
 ]
 
 
 def mainloop_status(*_):
     with DatabaseObject(db_file) as _dbo:
-        status_lines = []
-        for project_row in _dbo.get_projects():
-            name = project_row['project_name']
-            loc = project_row['project_location']
-            cat_id = project_row['category_id']
-            vcs_upstream = project_row['vcs_upstream']
-
-            status = gst(loc)
-            if status:
-                status = f" ({status})"
-
-            if vcs_upstream is None:
-                vcs_upstream = "Local"
-            else:
-                pattern = re.compile(r"https://github.com/([^/]+/[^/]+\.git)")
-                match = re.match(pattern, vcs_upstream)
-                if match is not None:
-                    vcs_upstream = "{" + f"{match.group(1)}" + "}"
+        projects = _dbo.get_projects()
 
-            status_lines += [
-                f"/----",
-                f"| {categories.get(cat_id, '-')}: {name}",
-                f"|   ~/{os.path.relpath(loc, os.path.expanduser('~'))}",
-                f"|   Upstream: {vcs_upstream}{status}"
-            ]
-        status_lines.append("\\----")
-        print("\n".join(status_lines))
+    project_rows = {project_row['project_location']: project_row for project_row in projects}
+    configs = load_configs(project_rows.keys())
+
+    # each project is printed as soon as its git status comes back.
+    for loc, status in get_status_memo().iter_statuses(project_rows.keys()):
+        project_row = project_rows[loc]
+        name = project_row['project_name']
+        cat_id = project_row['category_id']
+        vcs_upstream = project_row['vcs_upstream']
+
+        if status is None:
+            status = " (timed out)"
+        elif status:
+            status = f" ({status})"
+
+        if vcs_upstream is None:
+            vcs_upstream = "Local"
+        else:
+            pattern = re.compile(r"https://github.com/([^/]+/[^/]+\.git)")
+            match = re.match(pattern, vcs_upstream)
+            if match is not None:
+                vcs_upstream = "{" + f"{match.group(1)}" + "}"
+
+        status_lines = [
+            f"/----",
+            f"| {get_categories().get(cat_id, '-')}: {name}",
+            f"|   ~/{os.path.relpath(loc, os.path.expanduser('~'))}",
+            f"|   Upstream: {vcs_upstream}{status}"
+        ]
+        if configs.get(loc):
+            status_lines.insert(3, f"|   Settings: {settings_text(configs[loc])}")
+        print("\n".join(status_lines), flush=True)
+    print("\\----")
 
 
 def mainloop_git(tokens, *_):
@@ -238,37 +256,39 @@ def mainloop_git(tokens, *_):
     command = tokens.pop(0)
     with DatabaseObject(db_file) as _dbo:
         projects = _dbo.get_projects()
-        project_names = list(map(lambda x: x.get("project_name", None), projects))
+        names = list(map(lambda x: x.get("project_name", None), projects))
 
     if tokens:
         # implies there was an additional argument
-        project_names = [" ".join(tokens)]
+        names = [" ".join(tokens)]
 
     if command == "status":
-        result = []
+        project_rows = {}
 
         for project_row in projects:
             if tokens and " ".join(tokens) not in project_row.values():
                 continue
-            project_name = project_row['project_name']
-            if project_name in project_names:
-                project_loc = project_row['project_location']
-                status = gst(project_loc, raw=bool(tokens))
-                if not tokens:
-                    result.append(f"{project_name}: {status}")
-                else:
-                    dashes = '-' * len(project_name)
-                    result.append(f"{dashes}\n{project_name}\n{dashes}\n\n{status}\n")
-
-        final = "\n".join(result)
-
-        print(final)
+            if project_row['project_name'] in names:
+                project_rows[project_row['project_location']] = project_row
+
+        if tokens:
+            statuses = iter_statuses(project_rows.keys(), raw=True)
+        else:
+            statuses = get_status_memo().iter_statuses(project_rows.keys())
+        for project_loc, status in statuses:
+            project_name = project_rows[project_loc]['project_name']
+            if status is None:
+                status = "timed out"
+            if not tokens:
+                print(f"{project_name}: {status}", flush=True)
+            else:
+                dashes = '-' * len(project_name)
+                print(f"{dashes}\n{project_name}\n{dashes}\n\n{status}\n", flush=True)
         return
 
     if command not in ['commit', 'pull', 'push']:
         return
 
-    result = []
     if command == "commit":
         commit_message = prompt([
             {
@@ -281,54 +301,66 @@ def mainloop_git(tokens, *_):
         # to avoid warnings about use before reference
         commit_message = ""  # if this accidentally got used, it'd get stopped down below
 
+    steps_by_location = {}
+    location_names = {}
     for project_row in projects:
         if tokens and " ".join(tokens) not in project_row.values():
             continue
         project_name = project_row['project_name']
-        if project_name in project_names:
+        if project_name in names:
             project_loc = project_row['project_location']
             if command == "commit" and commit_message.strip():
-                status = git_func(project_loc, "commit", "am", project_loc + ": " + commit_message)
-            else:
-                status = git_func(project_loc, command)
-            if not tokens:
-                result.append(f"{project_name}: {status}")
+                steps = git_jobs.commit_steps(project_loc + ": " + commit_message, add_all=False)
             else:
-                dashes = '-' * len(project_name)
-                result.append(f"{dashes}\n{project_name}\n{dashes}\n\n{status}\n")
-
-    final = "\n".join(result)
-    print(final)
-
+                steps = [['git', command]]
+            steps_by_location[project_loc] = steps
+            location_names[project_loc] = project_name
 
+    if tokens:
+        for project_name in location_names.values():
+            dashes = '-' * len(project_name)
+            print(f"{dashes}\n{project_name}\n{dashes}\n")
+
+    # output of every project is printed as it comes, prefixed by the project when there are many.
+    job = git_jobs.GitJob(steps_by_location).start()
+    try:
+        for event in job.iter_events():
+            project_name = location_names[event.location]
+            if event.result is None:
+                print(event.line if tokens else f"{project_name}: {event.line}", flush=True)
+            elif event.result.returncode is None and not job.cancelled:
+                print(f"{project_name}: timed out", flush=True)
+    except KeyboardInterrupt:
+        job.cancel()
+        job.wait()
+        print("cancelled.")
+
+
+@instrumentation.timed()
 def cloc_text(by_file=False):
-    cwd = os.getcwd()
-    cmd_lst = ["cloc", "--exclude-dir=venv", "--json", "--include-ext=py"]
-
-    if by_file:
-        cmd_lst.append("--by_file")
-
-    cmd_lst.append(cwd)
-
-    cloc_res = subprocess.check_output(cmd_lst)
-    cloc_res = json.loads(cloc_res)
-
-    cloc_res = {k[len(cwd):] if k.startswith(cwd) else k: v for k, v in cloc_res.items() if k != "header"}
+    """ line counts of every registered project, by language or by file. """
+    with DatabaseObject(db_file) as _dbo:
+        roots = [row['project_location'] for row in _dbo.iter_projects() if os.path.isdir(row['project_location'])]
+    if not roots:
+        roots = [os.getcwd()]
 
-    files = list(cloc_res.keys())
-    cloc_res = {cat: [cloc_res[k].get(cat, None) for k in files] for cat in ['blank', 'comment', 'code', 'language']}
-    cloc_res = {'files': files, **cloc_res}
+    counts = line_counter.count_lines(roots)
+    return line_counter.summarize(counts, by="file" if by_file else "language", roots=roots)
 
-    cloc_res = pd.DataFrame(cloc_res)
-    cloc_res.set_index('files')
 
-    return cloc_res
+def mainloop_discover(tokens, *_):
+    """ register every project under some directories, DISCOVERY_ROOTS if none are given. """
+    roots = [os.path.expanduser(token) for token in tokens if token] or None
+    count = project_discovery.register_discovered(roots)
+    project_names.invalidate()
+    print(f"Registered {count} new project{'s' * (count != 1)}.")
 
 
 # Subroutines.
 mainloop_subroutines = {
     'status': mainloop_status,
-    'git': mainloop_git
+    'git': mainloop_git,
+    'discover': mainloop_discover,
 }
 
 
@@ -372,8 +404,12 @@ def main():
         command = tokens.pop(0)
 
         mainloop_func = mainloop_subroutines.get(command, lambda x: None)
-        mainloop_func(tokens)
+        with instrumentation.span(f"command {command}"):
+            mainloop_func(tokens)
 
 
 if __name__ == '__main__':
+    if "--profile" in sys.argv[1:]:
+        # print how long each command and the hot paths under it took, when the session ends.
+        instrumentation.dump_on_exit()
     main()
@@ -1,8 +1,15 @@
+import atexit
+import contextlib
+import functools
 import os
+import re
 import sqlite3
+import threading
 import project_board.project_board as proboard
-import pandas as pd
 import time
+from collections import namedtuple
+
+from instrumentation import span, timed
 
 versions = [
     "0_0_1a"
@@ -10,6 +17,12 @@ versions = [
 version = versions[-1]
 
 db_file = f"./dbfiles/{version}/cms.db"
+
+# the GUI and command line sessions share the database file. with WAL journaling readers never wait on a
+# writer, and writers wait up to BUSY_TIMEOUT seconds for each other instead of failing with
+# 'database is locked'.
+JOURNAL_MODE = os.getenv("PMK_DB_JOURNAL_MODE", "WAL")
+BUSY_TIMEOUT = float(os.getenv("PMK_DB_BUSY_TIMEOUT", 30))
 table_rows = {
     "categories": [
         "category_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL",
@@ -31,16 +44,316 @@ table_rows = {
         "category_id INT",
         "FOREIGN KEY (category_id) REFERENCES categories (category_id)",
     ],
+    "commits": [
+        "project_id INTEGER NOT NULL",
+        "sha TEXT NOT NULL",
+        "author TEXT NOT NULL",
+        "email TEXT NOT NULL",
+        "timestamp INTEGER NOT NULL",  # seconds since the epoch.
+        "tz_offset INTEGER NOT NULL",  # seconds east of UTC the commit was made in.
+        "PRIMARY KEY (project_id, sha)",
+        "FOREIGN KEY (project_id) REFERENCES projects (project_id)",
+    ],
+    "commit_index": [
+        "project_id INTEGER PRIMARY KEY NOT NULL",
+        "head TEXT NOT NULL",  # last HEAD ingested into commits.
+        "FOREIGN KEY (project_id) REFERENCES projects (project_id)",
+    ],
+    "line_counts": [
+        "path TEXT PRIMARY KEY NOT NULL",
+        "size INTEGER NOT NULL",
+        "mtime_ns INTEGER NOT NULL",
+        "language TEXT NOT NULL",
+        "blank INTEGER NOT NULL",
+        "comment INTEGER NOT NULL",
+        "code INTEGER NOT NULL",
+    ],
+    "scanned_dirs": [
+        "path TEXT PRIMARY KEY NOT NULL",
+        "mtime_ns INTEGER NOT NULL",
+        "children TEXT NOT NULL",  # names of the sub directories worth scanning, separated by NUL.
+        "is_project INTEGER NOT NULL",
+    ],
+    "boards": [
+        "board_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL",
+        "board_name TEXT NOT NULL UNIQUE",  # what projects.project_board refers to.
+    ],
+    "board_lists": [
+        "list_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL",
+        "board_id INTEGER NOT NULL",
+        "list_name TEXT NOT NULL",
+        "position INTEGER NOT NULL",
+        "UNIQUE (board_id, list_name)",
+        "FOREIGN KEY (board_id) REFERENCES boards (board_id)",
+    ],
+    "cards": [
+        "card_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL",
+        "list_id INTEGER NOT NULL",
+        "position INTEGER NOT NULL",
+        "card_name TEXT NOT NULL",
+        "contents TEXT",
+        "label_code INTEGER NOT NULL DEFAULT 0",  # ProjectLabels.code() of the card.
+        "FOREIGN KEY (list_id) REFERENCES board_lists (list_id)",
+    ],
 }
+table_indexes = {
+    "commits": [
+        "CREATE INDEX IF NOT EXISTS commits_timestamp ON commits (timestamp);",
+    ],
+    "cards": [
+        "CREATE INDEX IF NOT EXISTS cards_list ON cards (list_id, position);",
+        "CREATE INDEX IF NOT EXISTS cards_label_code ON cards (label_code, list_id);",
+    ],
+}
+
+
+class PooledConnection(sqlite3.Connection):
+    """ sqlite connection that keeps table metadata between uses, until the schema changes. """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.schema_version = None
+        self.table_schemas = {}  # table name -> rows of PRAGMA table_info
+
+    def check_schema_version(self):
+        """ drop cached table metadata if the schema changed, possibly from another connection. """
+        schema_version = self.execute("PRAGMA schema_version;").fetchone()[0]
+        if schema_version != self.schema_version:
+            self.table_schemas.clear()
+            self.schema_version = schema_version
+
+
+class ConnectionManager:
+    """
+    Process wide pool of sqlite connections, kept open between uses of DatabaseObject.
+
+    Connections are pooled per database file and handed out to one user at a time, so they can be shared
+    with background threads. The schema of a file is bootstrapped once per process, by the first
+    DatabaseObject to check out a connection to it.
+    """
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}  # file -> idle connections
+        self._bootstrap_locks = {}  # file -> lock held while bootstrapping the schema
+        self._bootstrapped = set()
+
+    @staticmethod
+    def _connect(file):
+        dir_name = os.path.dirname(file)
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        conn = sqlite3.connect(file, timeout=BUSY_TIMEOUT, check_same_thread=False, cached_statements=256,
+                               factory=PooledConnection)
+        try:
+            # the journal mode is stored in the file, this only changes it the first time.
+            if conn.execute(f"PRAGMA journal_mode={JOURNAL_MODE};").fetchone()[0].upper() == "WAL":
+                # commits in WAL mode can't corrupt the database without a sync, only lose the last ones on
+                # power loss.
+                conn.execute("PRAGMA synchronous=NORMAL;")
+        except sqlite3.OperationalError as error:
+            print(f"Could not set the journal mode of {file} to {JOURNAL_MODE}: {error}")
+        return conn
+
+    def checkout(self, file, force_reset=False):
+        """ get a connection to a database file, resetting the file first if asked to. """
+        file = os.path.abspath(file)
+        with self._lock:
+            if force_reset:
+                self._close_file(file)
+                for path in [file, file + "-wal", file + "-shm"]:
+                    if os.path.exists(path):
+                        os.remove(path)
+            idle = self._idle.get(file, [])
+            conn = idle.pop() if idle else None
+
+        if conn is None:
+            conn = self._connect(file)
+        return conn
+
+    def checkin(self, file, conn):
+        """ return a connection to the pool, closing it if the pool is already full. """
+        file = os.path.abspath(file)
+        with self._lock:
+            idle = self._idle.setdefault(file, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def bootstrap_lock(self, file):
+        """ lock to hold while bootstrapping the schema of a file. """
+        with self._lock:
+            return self._bootstrap_locks.setdefault(os.path.abspath(file), threading.Lock())
+
+    def is_bootstrapped(self, file):
+        return os.path.abspath(file) in self._bootstrapped
+
+    def mark_bootstrapped(self, file):
+        self._bootstrapped.add(os.path.abspath(file))
+
+    def _close_file(self, file):
+        for conn in self._idle.pop(file, []):
+            conn.close()
+        self._bootstrapped.discard(file)
+
+    def close_all(self):
+        """ close every idle connection, the schema will be checked again on next use. """
+        with self._lock:
+            for file in list(self._idle.keys()):
+                self._close_file(file)
+            self._bootstrapped.clear()
+
+
+connection_manager = ConnectionManager()
+atexit.register(connection_manager.close_all)
+
+
+class DataVersionWatcher:
+    """
+    Notices commits to a database file, made from any other connection of this process or another one.
+
+    PRAGMA data_version only changes for commits of other connections, so the watcher keeps a connection
+    of its own rather than using the pool.
+    """
+    def __init__(self, file):
+        self.file = file
+        self._conn = None
+        self._data_version = None
+
+    def changed(self):
+        """ True if the database was committed to since the last call, and on the first call once it exists. """
+        if self._conn is None:
+            if not os.path.exists(self.file):
+                return False
+            self._conn = sqlite3.connect(self.file, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        data_version = self._conn.execute("PRAGMA data_version;").fetchone()[0]
+        changed = data_version != self._data_version
+        self._data_version = data_version
+        return changed
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            self._data_version = None
+
+
+@functools.lru_cache(maxsize=None)
+def insert_query(table_name, cols, or_ignore=False):
+    """
+    Parameterized insert statement for a table and a tuple of columns.
+
+    The same statement text is returned for the same arguments, so sqlite's statement cache on each
+    connection can reuse the prepared statement.
+    """
+    verb = "INSERT OR IGNORE" if or_ignore else "INSERT"
+    return f"{verb} INTO {table_name} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))});"
+
+
+@functools.lru_cache(maxsize=None)
+def record_type(table_name, cols):
+    """
+    Compact record type for the rows of a table.
+
+    Records are namedtuples, so each row is a single tuple, but they can also be read like the dicts
+    the rows used to be, eg. row['project_name'], row.get('vcs_upstream') and row.values().
+    """
+    base = namedtuple(f"{table_name.title().replace('_', '')}Row", cols)
+
+    class Record(base):
+        __slots__ = ()
+
+        def __getitem__(self, item):
+            if isinstance(item, str):
+                return getattr(self, item)
+            return super().__getitem__(item)
+
+        def get(self, key, default=None):
+            return getattr(self, key, default) if key in self._fields else default
+
+        def keys(self):
+            return self._fields
+
+        def values(self):
+            return tuple(self)
+
+        def items(self):
+            return zip(self._fields, self)
+
+    Record.__name__ = Record.__qualname__ = base.__name__
+    return Record
+
+
+@functools.lru_cache(maxsize=None)
+def label_codes_matching(label_code):
+    """
+    Every label code sharing at least one label with label_code.
+
+    Any-match label queries look these up with IN, which can use the label_code index where a bitwise
+    AND in the query can't.
+    """
+    return tuple(code for code in range(1 << len(proboard.ProjectLabels.labels)) if code & label_code)
+
+
+def make_project_row(project_name, project_location, project_board=None, vcs_upstream=None, category_id=None):
+    """ row for the projects table, or None if the location doesn't exist. """
+    try:
+        stat = os.stat(project_location)
+    except OSError:
+        return None
+
+    strf_format = "%Y-%m-%d %H:%M:%S"
+    row_data = {
+        'project_name': project_name,
+        "project_location": project_location,
+        "created": time.strftime(strf_format, time.gmtime(stat.st_ctime)),
+        "modified": time.strftime(strf_format, time.gmtime(stat.st_mtime)),
+    }
+
+    if project_board is not None:
+        row_data['project_board'] = project_board
+
+    if vcs_upstream is not None:
+        row_data['vcs_upstream'] = vcs_upstream
+
+    if category_id is not None:
+        row_data['category_id'] = category_id
+
+    return row_data
 
 
 class DatabaseObject:
     def __init__(self, file, force_reset=False):
         self.file = file
         self.force_reset = force_reset
+        self.conn = None
+        self.cursor = None
+        self._transaction_depth = 0
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Write transaction, committed when the block ends or rolled back if it raises.
+
+        The write lock is taken up front with BEGIN IMMEDIATE, so waiting on another writer is covered by
+        the busy timeout. A transaction that reads first and writes later fails with 'database is locked'
+        if another process wrote in between. Readers don't wait on it, but other writers do, so keep the
+        block short. Nested blocks are part of the outermost transaction.
+        """
+        if self._transaction_depth:
+            yield self.conn
+            return
+
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN IMMEDIATE;")
+        self._transaction_depth += 1
+        try:
+            with self.conn:
+                yield self.conn
+        finally:
+            self._transaction_depth -= 1
 
     def get_all_tables(self):
-        self.conn.commit()
         cursor = self.conn.execute("SELECT name FROM sqlite_master WHERE "
                                    "type IN ('table','view') AND "
                                    "name NOT LIKE 'sqlite_%' ORDER BY 1;")
@@ -55,14 +368,29 @@ class DatabaseObject:
         return col_names
 
     def get_table_schema(self, table_name):
-        query = f"PRAGMA table_info({table_name});"
-        cursor = self.conn.execute(query)
-
-        schema = []
-        for row in cursor:
-            schema.append(row)
+        """ PRAGMA table_info of a table, cached on the connection until the schema changes. """
+        schema = self.conn.table_schemas.get(table_name, None)
+        if schema is None:
+            query = f"PRAGMA table_info({table_name});"
+            schema = self.conn.execute(query).fetchall()
+            self.conn.table_schemas[table_name] = schema
         return schema
 
+    def iter_rows(self, table_name, query=None, params=()):
+        """
+        Lazily iterate over the rows of a table as records, see record_type.
+
+        :param table_name: The table to read.
+        :param query: Query to run instead of selecting the whole table, must select every column in order.
+        :param params: Parameters of the query.
+        """
+        record = record_type(table_name, tuple(self.get_table_cols(table_name)))
+        new_record = tuple.__new__
+
+        cursor = self.conn.cursor()
+        cursor.row_factory = lambda _, row: new_record(record, row)
+        return cursor.execute(query or f"SELECT * FROM {table_name};", params)
+
     def make_table(self, table_name, rows):
         if table_name in self.get_all_tables():
             print(f"Table {table_name} already registered.")
@@ -71,132 +399,371 @@ class DatabaseObject:
         nl = ",\n"
         query = f'''CREATE TABLE {table_name}({nl.join(rows)});'''
         self.cursor.execute(query)
+        self.conn.table_schemas.pop(table_name, None)
 
     def add_row(self, table_name, row: dict):
-        cols = list(row.keys())
-        vals = [row[x] for x in cols]
+        cols = tuple(row.keys())
+        with self.transaction():
+            self.cursor.execute(insert_query(table_name, cols), [row[x] for x in cols])
 
-        col_s = str(tuple(cols))
-        val_s = str(tuple(vals))
+    def add_rows(self, table, lst, or_ignore=False):
+        """
+        Insert many rows in a single transaction.
 
-        if len(cols) == 1:
-            col_s = f"({cols[0]})"
-            val_s = f"({repr(vals[0])})"
+        Consecutive rows with the same columns are inserted with one executemany call.
 
-        for char in ' \'"':
-            col_s = col_s.replace(char, '')
-        query = f'''INSERT INTO {table_name} {col_s} VALUES {val_s};'''
-        self.cursor.execute(query)
-
-    def add_rows(self, table, lst):
+        :param table: The table name.
+        :param lst: The rows, as dicts of column name to value.
+        :param or_ignore: If True, rows conflicting with a UNIQUE constraint are skipped instead of raising.
+        """
+        batches = []
         for row in lst:
-            self.add_row(table, row)
+            cols = tuple(row.keys())
+            if not batches or batches[-1][0] != cols:
+                batches.append((cols, []))
+            batches[-1][1].append([row[x] for x in cols])
+
+        with self.transaction():
+            for cols, values in batches:
+                self.cursor.executemany(insert_query(table, cols, or_ignore), values)
 
     def get_categories(self):
-        query = "SELECT * FROM categories;"
-        cursor = self.conn.execute(query)
-        cols = self.get_table_cols("categories")
-        rows = []
-        for row in cursor:
-            rows.append({k: v for k, v in zip(cols, row)})
-        return {
-            row['category_id']: row['category_name'] for row in rows
-        }
+        query = "SELECT category_id, category_name FROM categories;"
+        return dict(self.conn.execute(query).fetchall())
 
     def add_category(self, category_name):
-        query = f"INSERT INTO categories (category_name) VALUES ({category_name});"
-        self.conn.execute(query)
+        self.add_row("categories", {"category_name": category_name})
 
     def get_projects(self):
-        cols = self.get_table_cols("projects")
-        return [{k: v for k, v in zip(cols, row)} for row in self.conn.execute("SELECT * FROM projects;")]
+        return list(self.iter_projects())
+
+    def iter_projects(self):
+        """ lazily iterate over the registered projects, without loading the whole table. """
+        return self.iter_rows("projects")
 
     def register_project(self, project_name, project_location, project_board=None, vcs_upstream=None, category_id=None):
-        if not os.path.exists(project_location):
+        row_data = make_project_row(project_name, project_location, project_board=project_board,
+                                    vcs_upstream=vcs_upstream, category_id=category_id)
+        if row_data is None:
             return
-        strf_format = "%Y-%m-%d %H:%M:%S"
-        ti_c = time.strftime(strf_format, time.gmtime(os.path.getctime(project_location)))
-        ti_m = time.strftime(strf_format, time.gmtime(os.path.getmtime(project_location)))
-
-        row_data = {
-            'project_name': project_name,
-            "project_location": project_location,
-            "created": ti_c,
-            "modified": ti_m,
-        }
-
-        if project_board is not None:
-            row_data['project_board'] = project_board
 
-        if vcs_upstream is not None:
-            row_data['vcs_upstream'] = vcs_upstream
+        self.add_row("projects", row_data)
 
-        if category_id is not None:
-            row_data['category_id'] = category_id
+    def register_projects(self, projects):
+        """
+        Register many projects in a single transaction, skipping projects that don't exist on disk and
+        projects whose name or location is already registered.
 
-        self.add_row("projects", row_data)
+        :param projects: dicts with the keyword arguments of register_project.
+        :returns: The number of projects registered.
+        """
+        rows = [row for row in (make_project_row(**kwargs) for kwargs in projects) if row is not None]
+        before = self.conn.total_changes
+        self.add_rows("projects", rows, or_ignore=True)
+        return self.conn.total_changes - before
 
     def register_category(self, category_name):
         self.add_row("categories", {"category_name": category_name})
 
+    def register_labels(self, labels):
+        """
+        Import many task labels in a single transaction.
+
+        :param labels: dict of label name to color, or an iterable of (label, color) pairs.
+        """
+        if isinstance(labels, dict):
+            labels = labels.items()
+        self.add_rows("task_labels", [{"label": label, "color": color} for label, color in labels])
+
     def update_project(self, project_name, project_location=None, project_board=None,
                        category_id=None, vcs_upstream=None):
-        update_clause = "UPDATE projects "
-        set_clause = "SET " + ", ".join([f"{col} = {val}" for col, val in
-                                         zip(["project_location", "project_board", "category_id", "vcs_upstream"],
-                                             [project_location, project_board, category_id, vcs_upstream])
-                                         if val is not None])
-        where_clause = f"WHERE project_name=\"{project_name}\";"
+        updates = [(col, val) for col, val in
+                   zip(["project_location", "project_board", "category_id", "vcs_upstream"],
+                       [project_location, project_board, category_id, vcs_upstream])
+                   if val is not None]
+        if not updates:
+            return
 
-        update_query = "\n".join([update_clause, set_clause, where_clause])
+        set_clause = ", ".join([f"{col} = ?" for col, _ in updates])
+        update_query = f"UPDATE projects SET {set_clause} WHERE project_name = ?;"
 
-        self.conn.execute(update_query)
+        with self.transaction():
+            self.conn.execute(update_query, [val for _, val in updates] + [project_name])
 
     def remove_project(self, project_name):
-        delete_query = f"DELETE FROM projects WHERE project_name='{project_name}'"
-        self.conn.execute(delete_query)
-
-    def __enter__(self):
-        file = self.file
-        dir_name = file[:-len(file.split("/")[-1])]
-
-        if not os.path.exists(dir_name):
-            os.makedirs(dir_name)
-        if os.path.exists(file) and self.force_reset:
-            os.remove(file)
+        project_ids = "SELECT project_id FROM projects WHERE project_name = ?"
+        with self.transaction():
+            for table in ["commits", "commit_index"]:
+                self.conn.execute(f"DELETE FROM {table} WHERE project_id IN ({project_ids});", (project_name,))
+            self.conn.execute("DELETE FROM projects WHERE project_name = ?;", (project_name,))
+
+    def get_indexed_head(self, project_id):
+        """ the last HEAD of a project ingested into the commits table, or None. """
+        row = self.conn.execute("SELECT head FROM commit_index WHERE project_id = ?;", (project_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def index_commits(self, project_id, head, commits, reset=False):
+        """
+        Add commits of a project to the commit index in a single transaction.
+
+        :param project_id: The project the commits belong to.
+        :param head: The HEAD the index is up to date with after adding the commits, None to clear the index.
+        :param commits: (sha, author, email, timestamp, tz_offset) tuples.
+        :param reset: If True, the indexed commits of the project are dropped first, eg. on rewritten history.
+        :returns: The number of commits added.
+        """
+        # commits may be read from a git process, read them all before taking the write lock so other
+        # processes don't wait on git.
+        commits = list(commits)
+        with self.transaction():
+            if reset or head is None:
+                self.conn.execute("DELETE FROM commits WHERE project_id = ?;", (project_id,))
+            added = self.conn.executemany(
+                "INSERT OR IGNORE INTO commits (project_id, sha, author, email, timestamp, tz_offset) "
+                "VALUES (?, ?, ?, ?, ?, ?);",
+                ((project_id, *commit) for commit in commits))
+            if head is None:
+                self.conn.execute("DELETE FROM commit_index WHERE project_id = ?;", (project_id,))
+            else:
+                self.conn.execute("INSERT OR REPLACE INTO commit_index (project_id, head) VALUES (?, ?);",
+                                  (project_id, head))
+        return added.rowcount
+
+    def get_commit_rows(self, project_ids=None, start=None, end=None):
+        """
+        (project_id, author, local time) of indexed commits, the local time being seconds since the epoch
+        shifted by the commit's timezone.
+
+        :param project_ids: Only include commits of these projects, all projects if None.
+        :param start: Only include commits made at or after this many seconds since the epoch.
+        :param end: Only include commits made before this many seconds since the epoch.
+        """
+        clauses, params = [], []
+        if project_ids is not None:
+            project_ids = list(project_ids)
+            clauses.append(f"project_id IN ({', '.join('?' * len(project_ids))})")
+            params += project_ids
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("timestamp < ?")
+            params.append(end)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        query = f"SELECT project_id, author, timestamp + tz_offset FROM commits{where};"
+        return self.conn.execute(query, params).fetchall()
+
+    def get_line_counts(self, root):
+        """
+        Cached line counts of the files under a directory.
+
+        :returns: {path: (size, mtime_ns, language, blank, comment, code)}
+        """
+        # every path under root sorts between root + '/' and root + '0', the character after '/'.
+        query = ("SELECT path, size, mtime_ns, language, blank, comment, code FROM line_counts "
+                 "WHERE path >= ? AND path < ?;")
+        root = root.rstrip("/")
+        return {row[0]: row[1:] for row in self.conn.execute(query, (root + "/", root + "0"))}
+
+    def set_line_counts(self, rows):
+        """ cache line counts, as (path, size, mtime_ns, language, blank, comment, code) rows. """
+        with self.transaction():
+            self.conn.executemany("INSERT OR REPLACE INTO line_counts "
+                                  "(path, size, mtime_ns, language, blank, comment, code) "
+                                  "VALUES (?, ?, ?, ?, ?, ?, ?);", rows)
+
+    def remove_line_counts(self, paths):
+        with self.transaction():
+            self.conn.executemany("DELETE FROM line_counts WHERE path = ?;", ((path,) for path in paths))
+
+    def get_scanned_dirs(self, root):
+        """
+        Directories under (and including) a root as of the last project discovery scan.
+
+        :returns: {path: (mtime_ns, children, is_project)}
+        """
+        query = ("SELECT path, mtime_ns, children, is_project FROM scanned_dirs "
+                 "WHERE path = ? OR (path >= ? AND path < ?);")
+        root = root.rstrip("/")
+        return {path: (mtime_ns, tuple(children.split("\0")) if children else (), bool(is_project))
+                for path, mtime_ns, children, is_project in self.conn.execute(query, (root, root + "/", root + "0"))}
+
+    def set_scanned_dirs(self, rows):
+        """ cache directory scans, as (path, mtime_ns, children, is_project) rows. """
+        with self.transaction():
+            self.conn.executemany("INSERT OR REPLACE INTO scanned_dirs (path, mtime_ns, children, is_project) "
+                                  "VALUES (?, ?, ?, ?);",
+                                  ((path, mtime_ns, "\0".join(children), int(is_project))
+                                   for path, mtime_ns, children, is_project in rows))
+
+    def remove_scanned_dirs(self, paths):
+        with self.transaction():
+            self.conn.executemany("DELETE FROM scanned_dirs WHERE path = ?;", ((path,) for path in paths))
+
+    def get_board_id(self, board_name):
+        row = self.conn.execute("SELECT board_id FROM boards WHERE board_name = ?;", (board_name,)).fetchone()
+        return None if row is None else row[0]
+
+    def get_board_lists(self, board_id):
+        """ (list_id, list_name) of the lists of a board, in order. """
+        query = "SELECT list_id, list_name FROM board_lists WHERE board_id = ? ORDER BY position;"
+        return self.conn.execute(query, (board_id,)).fetchall()
+
+    def get_cards(self, list_ids, label_code=None, exact=True):
+        """
+        (list_id, card_name, contents, label_code) of the cards in some lists, in order.
+
+        :param list_ids: The lists to read.
+        :param label_code: Only include cards with these labels, see ProjectLabels.code().
+        :param exact: If True, cards must have exactly these labels, otherwise any one of them.
+        """
+        list_ids = list(list_ids)
+        clauses = [f"list_id IN ({', '.join('?' * len(list_ids))})"]
+        params = list_ids
+        if label_code is not None:
+            codes = [label_code] if exact else label_codes_matching(label_code)
+            if not codes:
+                return []
+            clauses.append(f"label_code IN ({', '.join('?' * len(codes))})")
+            params += codes
+        query = (f"SELECT list_id, card_name, contents, label_code FROM cards "
+                 f"WHERE {' AND '.join(clauses)} ORDER BY list_id, position;")
+        return self.conn.execute(query, params).fetchall()
+
+    def save_board(self, board_name, lists):
+        """
+        Store a project board in a single transaction.
+
+        :param board_name: The board, created if it isn't stored yet.
+        :param lists: {list name: [(card name, contents, label code)]} in order. Lists missing from it are
+            removed, lists mapped to None keep their stored cards.
+        :returns: (board_id, {list name: list_id})
+        """
+        with self.transaction():
+            self.conn.execute("INSERT OR IGNORE INTO boards (board_name) VALUES (?);", (board_name,))
+            board_id = self.get_board_id(board_name)
+            list_ids = {list_name: list_id for list_id, list_name in self.get_board_lists(board_id)}
+
+            for list_name in set(list_ids.keys()) - set(lists.keys()):
+                list_id = list_ids.pop(list_name)
+                self.conn.execute("DELETE FROM cards WHERE list_id = ?;", (list_id,))
+                self.conn.execute("DELETE FROM board_lists WHERE list_id = ?;", (list_id,))
+
+            for position, (list_name, cards) in enumerate(lists.items()):
+                if list_name in list_ids:
+                    self.conn.execute("UPDATE board_lists SET position = ? WHERE list_id = ?;",
+                                      (position, list_ids[list_name]))
+                else:
+                    list_ids[list_name] = self.conn.execute(
+                        "INSERT INTO board_lists (board_id, list_name, position) VALUES (?, ?, ?);",
+                        (board_id, list_name, position)).lastrowid
+                if cards is None:
+                    continue
+
+                list_id = list_ids[list_name]
+                self.conn.execute("DELETE FROM cards WHERE list_id = ?;", (list_id,))
+                self.conn.executemany(
+                    "INSERT INTO cards (list_id, position, card_name, contents, label_code) VALUES (?, ?, ?, ?, ?);",
+                    ((list_id, card_position, *card) for card_position, card in enumerate(cards)))
+        return board_id, list_ids
+
+    def remove_board(self, board_name):
+        board_ids = "SELECT board_id FROM boards WHERE board_name = ?"
+        list_ids = f"SELECT list_id FROM board_lists WHERE board_id IN ({board_ids})"
+        with self.transaction():
+            self.conn.execute(f"DELETE FROM cards WHERE list_id IN ({list_ids});", (board_name,))
+            self.conn.execute(f"DELETE FROM board_lists WHERE board_id IN ({board_ids});", (board_name,))
+            self.conn.execute("DELETE FROM boards WHERE board_name = ?;", (board_name,))
+
+    def schema_is_complete(self):
+        """
+        True if every table and index exists, every migration ran and the task labels are seeded, checked
+        without a write lock.
+        """
+        import migrations
+
+        if not migrations.is_migrated(self):
+            return False
+        names = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master;")}
+        index_names = {re.search(r"INDEX IF NOT EXISTS (\w+)", query).group(1)
+                       for indexes in table_indexes.values() for query in indexes}
+        if not (set(table_rows.keys()) | index_names) <= names:
+            return False
+        return self.conn.execute("SELECT 1 FROM task_labels LIMIT 1;").fetchone() is not None
+
+    def bootstrap_schema(self):
+        """
+        create any missing tables and indexes, run pending migrations and seed the task labels.
+
+        A new database file of this version starts with the rows of the newest older version's file, unless
+        it was reset.
+
+        Safe to run from many processes at once: the checks and changes are made in one write transaction,
+        so a process waits for another one's bootstrap and then finds nothing left to do.
+        """
+        import migrations
+
+        if self.schema_is_complete():
+            return
 
-        self.conn = sqlite3.connect(self.file)
-        self.cursor = self.conn.cursor()
+        with self.transaction():
+            table_names = self.get_all_tables()
+            for tname, trows in table_rows.items():
+                if tname not in table_names:
+                    self.make_table(tname, trows)
+            for tname, indexes in table_indexes.items():
+                for index_query in indexes:
+                    self.cursor.execute(index_query)
+
+            fresh = not table_names and not self.force_reset
+            old_file = migrations.previous_version_file(self.file) if fresh else None
+            if old_file is not None:
+                print(f"Copying the projects of {old_file}.")
+                migrations.copy_database(self, old_file)
+            migrations.migrate(self)
+
+            if self.conn.execute("SELECT 1 FROM task_labels LIMIT 1;").fetchone() is None:
+                self.register_labels(proboard.ProjectLabels.labels)
 
-        table_names = self.get_all_tables()
-        for tname, trows in table_rows.items():
-            if tname not in table_names:
-                self.make_table(tname, trows)
-        table_names = self.get_all_tables()
+    def __enter__(self):
+        with span("DatabaseObject open"):
+            self.conn = connection_manager.checkout(self.file, force_reset=self.force_reset)
+            self.cursor = self.conn.cursor()
+            self.conn.check_schema_version()
 
-        if "task_labels" in table_names and not list(self.cursor.execute("SELECT * FROM task_labels")):
-            self.add_rows("task_labels", proboard.ProjectLabels.rows())
+            if not connection_manager.is_bootstrapped(self.file):
+                with connection_manager.bootstrap_lock(self.file):
+                    if not connection_manager.is_bootstrapped(self.file):
+                        self.bootstrap_schema()
+                        connection_manager.mark_bootstrapped(self.file)
 
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.conn.commit()
-        self.conn.close()
-
+        try:
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        finally:
+            self.cursor.close()
+            connection_manager.checkin(self.file, self.conn)
+            self.conn = None
+            self.cursor = None
+
+    @timed("str(dbo)")
     def __str__(self):
+        # pandas takes a while to import, only pay for it when the table is printed.
+        import pandas as pd
+
         str_chunks = []
         for table in self.get_all_tables():
             if table not in ["projects"]:
                 continue
             chunk = f"--- {table.capitalize()} ---"
             cols = self.get_table_cols(table)
-            df_dict = {key: [] for key in cols}
-
-            for row in self.conn.execute(f"SELECT * FROM {table}"):
-                for k, v in zip(cols, row):
-                    df_dict[k].append(v)
 
-            df = pd.DataFrame.from_dict(df_dict)
+            df = pd.DataFrame.from_records(self.conn.execute(f"SELECT * FROM {table}").fetchall(), columns=cols)
             df = df.set_index(cols[0])
 
             col_ind = df.columns
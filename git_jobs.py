@@ -0,0 +1,184 @@
+"""
+Runs git commands (commit, pull, push) across many projects at once.
+
+Commands are run without a shell, as argument lists, in each project's own directory. Output is streamed
+back line by line as an event queue, so the command line tool can print it as it comes and the GUI can
+pick it up between frames without blocking its render loop.
+"""
+import os
+import queue
+import signal
+import subprocess
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.getenv("PMK_JOB_WORKERS", 4))
+JOB_TIMEOUT = float(os.getenv("PMK_JOB_TIMEOUT", 120))
+
+# never wait on a terminal for credentials or a commit message.
+# the output is shown to the user as is, so it is left in their language.
+JOB_ENV = {**os.environ, "GIT_TERMINAL_PROMPT": "0", "GIT_EDITOR": "true"}
+
+# a line of output from a project, or with line None, the result of the project once all its steps ran.
+JobEvent = namedtuple("JobEvent", ["location", "line", "result"])
+# returncode is None if the project timed out or the job was cancelled.
+JobResult = namedtuple("JobResult", ["location", "returncode", "output"])
+
+
+def kill_process(proc):
+    """ kill a git process along with anything it started (eg. ssh), which would keep its output open. """
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def commit_steps(message, add_all=True):
+    """ steps committing every change of a project. """
+    if add_all:
+        return [['git', 'add', '--all'], ['git', 'commit', '-m', message]]
+    return [['git', 'commit', '-am', message]]
+
+
+def pull_steps():
+    return [['git', 'pull']]
+
+
+def push_steps():
+    return [['git', 'push']]
+
+
+class GitJob:
+    """
+    A batch of git commands run in many projects, at most `workers` projects at a time.
+
+    Each project has a list of steps (argument lists) run one after the other in its directory, every step
+    runs even if an earlier one failed (eg. pushing when there was nothing new to commit). A project is
+    stopped if it takes longer than `timeout` seconds in total, and the whole job can be cancelled.
+    """
+    def __init__(self, steps_by_location, workers=None, timeout=None):
+        self.steps_by_location = dict(steps_by_location)
+        self.workers = JOB_WORKERS if workers is None else workers
+        self.timeout = JOB_TIMEOUT if timeout is None else timeout
+
+        self.events = queue.Queue()
+        self.results = {}  # location -> JobResult
+
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._running = {}  # running git process -> location
+        self._timed_out = set()
+        self._thread = None
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="GitJob", daemon=True)
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """ stop every running git process, projects not started yet are skipped. """
+        self._cancelled.set()
+        with self._lock:
+            for proc in self._running.keys():
+                kill_process(proc)
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def iter_events(self):
+        """ JobEvents as they happen, until every project finished. for use from the command line. """
+        while not (self.done and self.events.empty()):
+            try:
+                yield self.events.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    def drain(self):
+        """ JobEvents that happened since the last call, without blocking. for use from a render loop. """
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def _run(self):
+        try:
+            locations = list(self.steps_by_location.keys())
+            if locations:
+                with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(locations)))) as executor:
+                    list(executor.map(self._run_project, locations))
+        finally:
+            self._done.set()
+
+    def _run_project(self, location):
+        output = []
+        returncode = 0
+
+        # kills the running step once the project is out of time.
+        timer = threading.Timer(self.timeout, self._time_out, args=(location,))
+        timer.daemon = True
+        timer.start()
+        try:
+            for argv in self.steps_by_location[location]:
+                if self.cancelled or location in self._timed_out:
+                    returncode = None
+                    break
+                step_code = self._run_step(location, argv, output)
+                if self.cancelled or location in self._timed_out:
+                    returncode = None
+                    break
+                if step_code != 0 and returncode == 0:
+                    returncode = step_code
+        finally:
+            timer.cancel()
+
+        result = JobResult(location, returncode, "\n".join(output))
+        self.results[location] = result
+        self.events.put(JobEvent(location, None, result))
+
+    def _run_step(self, location, argv, output):
+        try:
+            proc = subprocess.Popen(argv, cwd=location, env=JOB_ENV, stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    start_new_session=hasattr(os, "killpg"))
+        except OSError as error:
+            line = str(error)
+            output.append(line)
+            self.events.put(JobEvent(location, line, None))
+            return -1
+
+        with self._lock:
+            self._running[proc] = location
+            if self.cancelled or location in self._timed_out:
+                kill_process(proc)
+        try:
+            for raw_line in proc.stdout:
+                line = raw_line.decode('utf-8', errors='replace').rstrip("\n")
+                output.append(line)
+                self.events.put(JobEvent(location, line, None))
+            return proc.wait()
+        finally:
+            proc.stdout.close()
+            with self._lock:
+                self._running.pop(proc, None)
+
+    def _time_out(self, location):
+        with self._lock:
+            self._timed_out.add(location)
+            for proc, proc_location in self._running.items():
+                if proc_location == location:
+                    kill_process(proc)
@@ -0,0 +1,358 @@
+"""
+Git status of registered projects, shared by the GUI and the command line tool.
+
+Statuses are read from `git status --porcelain=v2 -z --branch`, which is meant for scripts: it doesn't
+depend on the user's language, skips the advice the long format computes, and NUL separated paths need
+no unquoting. Each status is parsed into a GitStatus record.
+
+The status of a project is summarised in 'status bits', one character per kind of change:
+    ! modified, ? untracked, * ahead of upstream, + new file, > renamed, x deleted
+
+Listing untracked files means walking the whole working tree, which is most of the time git takes on
+huge trees. With PMK_STATUS_UNTRACKED=0 (or untracked=False) they aren't looked for, and the untracked
+count of the statuses is None.
+"""
+import os
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from instrumentation import timed
+
+STATUS_KEYS = "!?*+>x"
+
+# without optional locks, git status doesn't rewrite the index, which would look like a change to a watcher.
+# the locale is left alone: porcelain output doesn't depend on it, and the long format is shown to the user.
+GIT_ENV = {**os.environ, "GIT_OPTIONAL_LOCKS": "0"}
+
+# defaults for checking many projects at once, overridable from the environment.
+STATUS_WORKERS = int(os.getenv("PMK_STATUS_WORKERS", 8))
+STATUS_TIMEOUT = float(os.getenv("PMK_STATUS_TIMEOUT", 15))
+STATUS_UNTRACKED = os.getenv("PMK_STATUS_UNTRACKED", "1") != "0"
+
+# statuses of projects git couldn't be run in, see iter_statuses.
+STATUS_MISSING = "missing"
+STATUS_ERROR = "error"
+
+
+class GitStatus(namedtuple("GitStatus", ["branch", "upstream", "ahead", "behind", "staged", "unstaged",
+                                         "untracked", "unmerged", "added", "renamed", "deleted", "modified"])):
+    """
+    Status of a git working tree.
+
+    branch is None when HEAD is detached, and upstream when the branch has none, in which case ahead and
+    behind are 0. staged and unstaged count the changed paths in the index and in the working tree,
+    a path changed in both counts in both. untracked is None if untracked files weren't looked for.
+    """
+    __slots__ = ()
+
+    def bits(self):
+        """ the status bits of the status. """
+        return "".join(key for key, flag in zip(STATUS_KEYS, [
+            self.modified, self.untracked, self.ahead, self.added, self.renamed, self.deleted]) if flag)
+
+
+def parse_porcelain_v2(output):
+    """
+    Parse the output of `git status --porcelain=v2 -z --branch`.
+
+    :param output: The output, as bytes.
+    :returns: A GitStatus, with untracked None if there can't have been any untracked entries.
+    """
+    branch = upstream = None
+    ahead = behind = 0
+    staged = unstaged = untracked = unmerged = added = renamed = deleted = modified = 0
+
+    entries = output.split(b"\0")
+    i = 0
+    while i < len(entries):
+        entry = entries[i]
+        i += 1
+        if not entry:
+            continue
+        kind = entry[:1]
+        if kind == b"#":
+            header, _, value = entry[2:].decode('utf-8', errors='replace').partition(" ")
+            if header == "branch.head":
+                branch = None if value == "(detached)" else value
+            elif header == "branch.upstream":
+                upstream = value
+            elif header == "branch.ab":
+                a, b = value.split(" ")
+                ahead, behind = int(a), -int(b)
+        elif kind in (b"1", b"2"):
+            xy = entry[2:4]
+            staged += xy[:1] != b"."
+            unstaged += xy[1:] != b"."
+            added += xy[:1] == b"A"
+            deleted += b"D" in xy
+            modified += b"M" in xy
+            if kind == b"2":
+                renamed += 1
+                # the path the entry was renamed or copied from follows as its own entry.
+                i += 1
+        elif kind == b"u":
+            unmerged += 1
+        elif kind == b"?":
+            untracked += 1
+
+    return GitStatus(branch, upstream, ahead, behind, staged, unstaged, untracked, unmerged, added, renamed,
+                     deleted, modified)
+
+
+@timed("git status --porcelain")
+def git_status(location, untracked=None, timeout=None):
+    """
+    Status of a project, from machine readable git status output.
+
+    :param location: The project location.
+    :param untracked: If False, don't look for untracked files, defaults to STATUS_UNTRACKED.
+    :param timeout: Seconds to wait for git before giving up, raises subprocess.TimeoutExpired.
+    :returns: A GitStatus, or None if the location isn't a git working tree.
+    """
+    untracked = STATUS_UNTRACKED if untracked is None else untracked
+    res = subprocess.run(['git', 'status', '--porcelain=v2', '-z', '--branch',
+                          f"--untracked-files={'normal' if untracked else 'no'}"],
+                         cwd=location, env=GIT_ENV, timeout=timeout,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if res.returncode != 0:
+        return None
+    status = parse_porcelain_v2(res.stdout)
+    return status if untracked else status._replace(untracked=None)
+
+
+@timed("git status")
+def git_status_output(location, timeout=None):
+    """
+    Run `git status` inside a project, without changing the working directory of this process.
+
+    :param location: The project location.
+    :param timeout: Seconds to wait for git before giving up, raises subprocess.TimeoutExpired.
+    :returns: The output of git status.
+    """
+    res = subprocess.run(['git', 'status'], cwd=location, env=GIT_ENV, timeout=timeout,
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return res.stdout.decode('utf-8', errors='replace').rstrip("\n")
+
+
+def status_bits(location, untracked=None, timeout=None):
+    """ get the git status bits of a project, empty if it isn't a git working tree. """
+    status = git_status(location, untracked=untracked, timeout=timeout)
+    return "" if status is None else status.bits()
+
+
+def iter_statuses(locations, raw=False, workers=None, timeout=None, untracked=None):
+    """
+    Get the status of many projects concurrently, each git process running in its own project.
+
+    :param locations: The project locations.
+    :param raw: If True, yield the full git status output instead of the status bits.
+    :param workers: The number of git processes to run at once, defaults to STATUS_WORKERS.
+    :param timeout: Seconds to wait on any one project, defaults to STATUS_TIMEOUT.
+    :param untracked: If False, don't look for untracked files, defaults to STATUS_UNTRACKED.
+    :returns: Generator of (location, status) in the order the projects finish, status is None when git
+        timed out, STATUS_MISSING when the location isn't a directory (eg. the project was moved) and
+        STATUS_ERROR when git could not be run.
+    """
+    workers = STATUS_WORKERS if workers is None else workers
+    timeout = STATUS_TIMEOUT if timeout is None else timeout
+
+    def worker(loc):
+        try:
+            if raw:
+                return git_status_output(loc, timeout=timeout)
+            return status_bits(loc, untracked=untracked, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return None
+        except OSError:
+            return STATUS_ERROR if os.path.isdir(loc) else STATUS_MISSING
+
+    locations = list(locations)
+    if not locations:
+        return
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(locations)))) as executor:
+        futures = {executor.submit(worker, loc): loc for loc in locations}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def format_age(seconds):
+    """ short human readable age of a snapshot entry, eg. '4s', '2m', '1h'. """
+    if seconds is None:
+        return "-"
+    for unit, size in [("h", 3600), ("m", 60)]:
+        if seconds >= size:
+            return f"{int(seconds // size)}{unit}"
+    return f"{int(seconds)}s"
+
+
+class StatusMemo:
+    """
+    Last known status bits of each project, for status listings in a long running session.
+
+    With a ProjectWatcher, a listing only runs git in the projects that changed on disk since the last
+    listing, that can't be watched, or whose status is older than `watched_interval` seconds, as changes
+    made from another host (eg. to a networked home directory) don't reach the watcher.
+    """
+    def __init__(self, watcher=None, watched_interval=300.0):
+        self.watcher = watcher
+        self.watched_interval = watched_interval
+        self.statuses = {}  # location -> (status bits, time.monotonic() of the status)
+
+    def iter_statuses(self, locations, workers=None, timeout=None):
+        """ like iter_statuses, known statuses of unchanged projects come first. """
+        locations = list(locations)
+        if self.watcher is None:
+            stale = locations
+        else:
+            self.watcher.set_locations(locations)
+            dirty = self.watcher.take_dirty()
+            expired = time.monotonic() - self.watched_interval
+            stale = [loc for loc in locations
+                     if loc not in self.statuses or loc in dirty or not self.watcher.is_watched(loc)
+                     or self.statuses[loc][1] < expired]
+
+        stale_set = set(stale)
+        for loc in locations:
+            if loc not in stale_set:
+                yield loc, self.statuses[loc][0]
+
+        for loc, status in iter_statuses(stale, workers=workers, timeout=timeout):
+            if status in (None, STATUS_MISSING, STATUS_ERROR):
+                self.statuses.pop(loc, None)
+            else:
+                self.statuses[loc] = (status, time.monotonic())
+            yield loc, status
+
+
+class StatusCache:
+    """
+    Background service keeping a snapshot of the status bits of each project.
+
+    A worker thread refreshes each location once every `interval` seconds, readers only ever look at
+    the snapshot so they never wait on git. With a ProjectWatcher, projects it watches are instead
+    refreshed when they change on disk, and otherwise only every `watched_interval` seconds.
+    """
+    def __init__(self, interval=10.0, watcher=None, watched_interval=300.0):
+        self.interval = interval
+        self.watcher = watcher
+        self.watched_interval = watched_interval
+        if watcher is not None:
+            watcher.on_dirty = self.refresh
+        self.locations = []
+        self.snapshot = {}  # location -> (status bits, time.monotonic() of the refresh)
+        self.version = 0  # bumped whenever the snapshot changes.
+        self._forced = set()  # locations to refresh ahead of their schedule.
+        self._watch_locations = None  # locations the worker is yet to hand to the watcher.
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def set_locations(self, locations):
+        """ set the project locations to keep track of, dropping snapshots of removed projects. """
+        locations = list(locations)
+        with self._lock:
+            if locations == self.locations:
+                return
+            self.locations = locations
+            for loc in list(self.snapshot.keys()):
+                if loc not in locations:
+                    self.snapshot.pop(loc)
+                    self.version += 1
+            # watching a project walks its whole tree, which the worker does rather than the caller (eg. the
+            # GUI's render thread).
+            if self.watcher is not None:
+                self._watch_locations = locations
+        self._wake.set()
+
+    def get(self, location):
+        """
+        Get the last known status of a project.
+
+        :returns: (status bits, age in seconds), or (None, None) if the project was never refreshed.
+        """
+        with self._lock:
+            entry = self.snapshot.get(location, None)
+        if entry is None:
+            return None, None
+        bits, refreshed = entry
+        return bits, time.monotonic() - refreshed
+
+    def refresh(self, location=None):
+        """ ask the worker to refresh a location (or every location) as soon as possible. """
+        with self._lock:
+            self._forced.update(self.locations if location is None else [location])
+        self._wake.set()
+
+    def _next_due(self):
+        """ location most overdue for a refresh along with how long until it is due. """
+        now = time.monotonic()
+        with self._lock:
+            best, best_wait = None, None
+            for loc in self.locations:
+                entry = self.snapshot.get(loc, None)
+                if loc in self._forced or entry is None:
+                    wait = 0
+                elif self.watcher is not None and self.watcher.is_watched(loc):
+                    wait = entry[1] + self.watched_interval - now
+                else:
+                    wait = entry[1] + self.interval - now
+                if best_wait is None or wait < best_wait:
+                    best, best_wait = loc, wait
+        return best, best_wait
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            with self._lock:
+                watch_locations, self._watch_locations = self._watch_locations, None
+            if watch_locations is not None:
+                self.watcher.set_locations(watch_locations)
+
+            location, wait = self._next_due()
+            if location is None or wait > 0:
+                self._wake.wait(timeout=wait)
+                continue
+
+            with self._lock:
+                self._forced.discard(location)
+            if os.path.isdir(location):
+                try:
+                    bits = status_bits(location, timeout=STATUS_TIMEOUT)
+                except (OSError, subprocess.TimeoutExpired):
+                    bits = ""
+            else:
+                bits = ""
+
+            with self._lock:
+                if location in self.locations:
+                    old = self.snapshot.get(location, (None, None))[0]
+                    self.snapshot[location] = (bits, time.monotonic())
+                    if old != bits:
+                        self.version += 1
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="StatusCache", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
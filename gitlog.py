@@ -1,79 +1,207 @@
 import math
 import os
 import subprocess
-import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date, timedelta
+
+import numpy as np
+
 from database_api import DatabaseObject, db_file
+from instrumentation import timed
+from lazy_state import lazy_state
 
 HOME_FOLDER = os.path.expanduser('~')
-PROJECTS_FOLDERS = []
 ORIGINAL_CWD = os.getcwd()
 
-with DatabaseObject(db_file) as dbo:
-    for project_row in dbo.get_projects():
-        location = project_row['project_location']
-        if os.path.exists(f"{location}/.git"):
-            PROJECTS_FOLDERS.append(location)
-
-DITHERING_BLOCKS = list("_=/%#")
-
-
-def get_git_log(project_index):
-    project = PROJECTS_FOLDERS[project_index]
-
-    os.chdir(project)
-    res = subprocess.check_output(['git', 'log'])
-    res = res.decode('utf-8')
-
-    os.chdir(ORIGINAL_CWD)
-
-    pattern = re.compile(r"commit ([\da-f]+)\nAuthor: (.+)(<.+>)\nDate:(.+)\n")
-    re_res = re.finditer(pattern, res)
-
-    starts = []
-    ends = []
-
-    commit_ids = []
-    authors = []
-    author_emails = []
-    dates = []
-
-    for match in re_res:
-        starts.append(match.span()[0])
-        ends.append(match.span()[1])
+EPOCH = date(1970, 1, 1)
+SECONDS_PER_DAY = 24 * 60 * 60
+SECONDS_PER_HOUR = 60 * 60
+LOG_FORMAT = "%H%x00%an%x00%ae%x00%at%x00%ad"  # with --date=format:%z, %ad is the timezone.
+LOG_CHUNK_SIZE = 1 << 16
 
-        commit_ids.append(match.group(1).strip())
-        authors.append(match.group(2).strip())
-        author_emails.append(match.group(3).strip())
-        dates.append(match.group(4).strip())
+# timestamp is seconds since the epoch, tz_offset is seconds east of UTC.
+Commit = namedtuple("Commit", ["sha", "author", "email", "timestamp", "tz_offset"])
 
-    log = {
-        commit_id: (author, email, _date)
-        for commit_id, author, email, _date in zip(commit_ids, authors, author_emails, dates)
-    }
-
-    starts.append(len(res))
-    commits = []
+DITHERING_BLOCKS = list("_=/%#")
 
-    for s, m, e in zip(starts[:-1], ends, starts[1:]):
-        commits.append((res[s:m], res[m:e]))
 
-    return log
+@lazy_state
+def get_git_projects():
+    """ (locations, project ids) of the registered projects that are git repositories. """
+    projects_folders = []
+    project_ids = []
+    with DatabaseObject(db_file) as _dbo:
+        for project_row in _dbo.iter_projects():
+            location = project_row['project_location']
+            if os.path.exists(f"{location}/.git"):
+                projects_folders.append(location)
+                project_ids.append(project_row['project_id'])
+    return projects_folders, project_ids
+
+
+def __getattr__(name):
+    # PROJECTS_FOLDERS and PROJECT_IDS are looked up on first use, refresh with get_git_projects.refresh()
+    if name == "PROJECTS_FOLDERS":
+        return get_git_projects()[0]
+    if name == "PROJECT_IDS":
+        return get_git_projects()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def epoch_seconds(when):
+    """ seconds since the epoch of a date (local midnight), datetime (local if naive) or number of seconds. """
+    if isinstance(when, datetime):
+        return int(when.timestamp())
+    if isinstance(when, date):
+        return int(datetime(when.year, when.month, when.day).timestamp())
+    return int(when)
+
+
+def git_date_arg(when):
+    """ date argument for git's --since / --until, from a date, datetime or seconds since the epoch. """
+    return f"@{epoch_seconds(when)}"
+
+
+def parse_tz_offset(tz):
+    """ '+0130' -> seconds east of UTC """
+    sign = -1 if tz.startswith('-') else 1
+    return sign * (int(tz[1:3]) * 3600 + int(tz[3:5]) * 60)
+
+
+def parse_commit(fields):
+    """ Commit from the raw fields of one LOG_FORMAT record. """
+    sha, author, email, timestamp, tz = fields
+    return Commit(sha.decode('ascii'), author.decode('utf-8', errors='replace'),
+                  email.decode('utf-8', errors='replace'), int(timestamp), parse_tz_offset(tz.decode('ascii')))
+
+
+def iter_git_log(location, rev_range=None, since=None, until=None):
+    """
+    Stream the commits of a repository from git log, without holding the whole log in memory.
+
+    The log is read in machine readable, NUL delimited form straight from the pipe.
+
+    :param location: The repository location.
+    :param rev_range: Revisions to list, eg. 'abc123..HEAD', defaults to HEAD.
+    :param since: Only list commits authored at or after this (date, datetime or seconds since epoch).
+    :param until: Only list commits authored at or before this.
+    :returns: Generator of Commit records, newest first.
+    """
+    since = None if since is None else epoch_seconds(since)
+    until = None if until is None else epoch_seconds(until)
+    for commit in _iter_git_log(location, rev_range, since):
+        if (since is None or commit.timestamp >= since) and (until is None or commit.timestamp <= until):
+            yield commit
+
+
+def _iter_git_log(location, rev_range=None, since=None):
+    """ iter_git_log, without filtering the commits by their author date. """
+    cmd = ['git', 'log', '-z', '--date=format:%z', f'--format={LOG_FORMAT}']
+    if since is not None:
+        # git's --since filters on the committer date, which is no earlier than the author date (a rebased
+        # commit keeps its author date), so this only leaves out commits authored before since, and lets git
+        # stop early. there's no such bound for --until, which iter_git_log checks by itself.
+        cmd.append(f"--since={git_date_arg(since)}")
+    if rev_range is not None:
+        cmd.append(rev_range)
+
+    proc = subprocess.Popen(cmd, cwd=location, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        fields = []
+        tail = b""
+        while True:
+            chunk = proc.stdout.read(LOG_CHUNK_SIZE)
+            if not chunk:
+                break
+            *complete, tail = (tail + chunk).split(b"\0")
+            for field in complete:
+                fields.append(field)
+                if len(fields) == len(Commit._fields):
+                    yield parse_commit(fields)
+                    fields = []
+        # the last record has no NUL after it.
+        if tail:
+            fields.append(tail)
+        if len(fields) == len(Commit._fields):
+            yield parse_commit(fields)
+
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.stdout.close()
+        proc.wait()
+
+
+def get_git_log(project_index, since=None, until=None):
+    """ the commits of a project as {sha: Commit} """
+    project = get_git_projects()[0][project_index]
+    return {commit.sha: commit for commit in iter_git_log(project, since=since, until=until)}
+
+
+def git_head(location):
+    """ sha of the HEAD commit of a repository, None if it has no commits. """
+    res = subprocess.run(['git', 'rev-parse', '--verify', '-q', 'HEAD'], cwd=location,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    head = res.stdout.decode('utf-8').strip()
+    return head if res.returncode == 0 and head else None
+
+
+def is_ancestor(location, old, new):
+    """ True if commit `old` is still in the history of `new`, ie. history wasn't rewritten. """
+    res = subprocess.run(['git', 'merge-base', '--is-ancestor', old, new], cwd=location,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return res.returncode == 0
+
+
+def index_project(dbo, project_id, location, head):
+    """
+    Bring the commit index of a project up to date with its HEAD.
+
+    Only the commits after the last indexed HEAD are read from git, unless the history was rewritten
+    since (eg. by a rebase or a reset), in which case the project is indexed again from scratch.
+
+    :returns: The number of commits added to the index.
+    """
+    last = dbo.get_indexed_head(project_id)
+    if head == last:
+        return 0
+    if head is None:
+        dbo.index_commits(project_id, None, [])
+        return 0
+
+    if last is not None and is_ancestor(location, last, head):
+        return dbo.index_commits(project_id, head, iter_git_log(location, f"{last}..{head}"))
+    return dbo.index_commits(project_id, head, iter_git_log(location, head), reset=True)
+
+
+@timed()
+def refresh_commit_index():
+    """ update the commit index of every project, looking up the HEAD of each repository concurrently. """
+    projects_folders, project_ids = get_git_projects()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        heads = list(executor.map(git_head, projects_folders))
+
+    with DatabaseObject(db_file) as _dbo:
+        for project_id, location, head in zip(project_ids, projects_folders, heads):
+            index_project(_dbo, project_id, location, head)
+
+
+def commit_date(commit):
+    """ the date a commit was made on, in the committer's timezone. """
+    return EPOCH + timedelta(days=(commit.timestamp + commit.tz_offset) // SECONDS_PER_DAY)
 
 
 def organize_by_date(log):
-    str_parse_time_format = "%a %b %d %H:%M:%S %Y %z"
+    """ group the commits of get_git_log by date, as {'YYYY-MM-DD': [Commit, ...]} """
     organized = {}
-    for commit_id, tup in log.items():
-        auth, email, _date = tup
-        date_obj = datetime.strptime(_date, str_parse_time_format)
-
-        org_by = date_obj.date()
-
-        key = str(org_by)
+    for commit in log.values():
+        key = str(commit_date(commit))
 
         lst = organized.get(key, [])
-        lst.append((commit_id, auth, email, _date, date_obj))
+        lst.append(commit)
         organized[key] = lst
 
     return organized
@@ -88,36 +216,91 @@ def clamp(n, mi, ma):
     return min(max(n, mi), ma)
 
 
-def get_git_log_summary(start_date=None, end_date=None):
-    all_orgd = {}
-    for i in range(len(PROJECTS_FOLDERS)):
-        lg = get_git_log(i)
-        orgd = organize_by_date(lg)
+def get_commit_arrays(start_date=None, end_date=None):
+    """
+    The indexed commits of every project as arrays, after bringing the index up to date.
+
+    :param start_date: Only include commits made on or after this date, in the committer's timezone.
+    :param end_date: Only include commits made on or before this date.
+    :returns: (project_ids, authors, local_times) arrays, local times in seconds since the epoch in the
+        committer's timezone.
+    """
+    refresh_commit_index()
+
+    # commit dates are local to the committer, so look a day past either end and filter by local date.
+    start = None if start_date is None else ((start_date - EPOCH).days - 1) * SECONDS_PER_DAY
+    end = None if end_date is None else ((end_date - EPOCH).days + 2) * SECONDS_PER_DAY
+
+    with DatabaseObject(db_file) as _dbo:
+        rows = _dbo.get_commit_rows(get_git_projects()[1], start, end)
+
+    project_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    authors = np.array([row[1] for row in rows], dtype=object)
+    local_times = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+
+    days = local_times // SECONDS_PER_DAY
+    keep = np.ones(len(rows), dtype=bool)
+    if start_date is not None:
+        keep &= days >= (start_date - EPOCH).days
+    if end_date is not None:
+        keep &= days <= (end_date - EPOCH).days
+
+    return project_ids[keep], authors[keep], local_times[keep]
+
+
+@timed()
+def get_commit_activity(start_date=None, end_date=None, by=None):
+    """
+    Commit counts of every project, aggregated with numpy.
+
+    :param start_date: First day to count, defaults to the day of the first commit.
+    :param end_date: Last day to count, defaults to the day of the last commit.
+    :param by: How to group the commits:
+        None: commits per day, shape (days,)
+        'project': commits per project per day, shape (projects, days), labelled by project_id
+        'author': commits per author per day, shape (authors, days), labelled by author
+        'weekday': commits per weekday, shape (7,), monday first
+        'hour': commits per hour of the day, shape (24,)
+    :returns: (counts, labels, (start_date, end_date)), labels is None unless grouping by project or author.
+    """
+    project_ids, authors, local_times = get_commit_arrays(start_date, end_date)
+    days = local_times // SECONDS_PER_DAY
 
-        for key in orgd.keys():
-            lst = all_orgd.get(key, [])
-            lst += orgd[key]
-            all_orgd[key] = lst
+    if start_date is None:
+        start_date = EPOCH + timedelta(days=int(days.min())) if len(days) else date.today()
+    if end_date is None:
+        end_date = EPOCH + timedelta(days=int(days.max())) if len(days) else date.today()
 
-    orgd = all_orgd
+    if by == 'weekday':
+        # the epoch was a thursday.
+        return np.bincount((days + 3) % 7, minlength=7), None, (start_date, end_date)
+    if by == 'hour':
+        return np.bincount((local_times // SECONDS_PER_HOUR) % 24, minlength=24), None, (start_date, end_date)
 
-    days = sum([[x[4].date() for x in v] for k, v in orgd.items()], [])
+    num_days = (end_date - start_date).days + 1
+    day_offsets = days - (start_date - EPOCH).days
 
-    commits_by_days = []
+    if by is None:
+        return np.bincount(day_offsets, minlength=num_days), None, (start_date, end_date)
 
-    if start_date is None:
-        start_date = min(days)
-    if end_date is None:
-        end_date = max(days)
+    if by == 'project':
+        labels, groups = np.unique(project_ids, return_inverse=True)
+    elif by == 'author':
+        labels, groups = np.unique(authors.astype(str), return_inverse=True)
+    else:
+        raise ValueError(f"unknown grouping {repr(by)}")
 
-    for single_date in daterange(start_date, end_date):
-        key = single_date.strftime("%Y-%m-%d")
-        num_commits = len(orgd.get(key, []))
-        commits_by_days.append(num_commits)
+    counts = np.bincount(groups * num_days + day_offsets, minlength=len(labels) * num_days)
+    return counts.reshape(len(labels), num_days), labels, (start_date, end_date)
 
-    return commits_by_days, (start_date, end_date)
+
+def get_git_log_summary(start_date=None, end_date=None):
+    """ commits per day across every project, as an int array, along with the date range it covers. """
+    commits_by_days, _, date_range = get_commit_activity(start_date, end_date)
+    return commits_by_days, date_range
 
 
+@timed()
 def plot_git_activity():
     today = date.today()
     one_year_ago = date(today.year - 1, today.month, today.day)
@@ -126,19 +309,19 @@ def plot_git_activity():
     sd, ed = dr
     dates = [d for d in daterange(sd, ed)]
 
-    max_comms = max(cbd + [1])
+    max_comms = max(int(cbd.max(initial=0)), 1)
     num_blocks = len(DITHERING_BLOCKS)
     possible = list(range(max_comms+1))
-    dithering_indices = list(map(
-        lambda x: clamp(math.ceil(x * (num_blocks - 1) / max_comms), 0, num_blocks-1), cbd))
-    dithering_blocks = list(map(lambda di: DITHERING_BLOCKS[di], dithering_indices))
+    dithering_indices = np.clip(np.ceil(cbd * (num_blocks - 1) / max_comms).astype(np.int64), 0, num_blocks-1)
+    dithering_blocks = np.array(DITHERING_BLOCKS)[dithering_indices]
 
     possible_indices = list(map(
         lambda x: clamp(math.ceil(x * (num_blocks - 1) / max_comms), 0, num_blocks-1), possible))
     possible_blocks = list(map(lambda di: DITHERING_BLOCKS[di], possible_indices))
 
+    # with fewer commits a day than blocks, some blocks are never used.
     dither_bounds = {x: (possible_blocks.index(x), max_comms - possible_blocks[::-1].index(x))
-                     for x in DITHERING_BLOCKS}
+                     for x in DITHERING_BLOCKS if x in possible_blocks}
 
     db_strs = {x: str(t[0]) if t[0] == t[1] else f"{t[0]}-{t[1]}" for x, t in dither_bounds.items()}
 
@@ -18,10 +18,10 @@ if __name__ != "__main__":
 
 import json
 import os
-import subprocess
 import sys
-
-import pandas as pd
+import threading
+import time
+from collections import deque
 
 from database_api import version as app_version
 from database_api import get_dbo_str, db_file, DatabaseObject
@@ -34,10 +34,15 @@ import OpenGL.GL as GL
 import imgui
 from imgui.integrations.glfw import GlfwRenderer
 import gitlog
+import git_jobs
+import line_counter
+from git_status import StatusCache
+import instrumentation
+from project_watcher import ProjectWatcher
+from view_model import PanelViewModel
 from screeninfo import get_monitors
 from datetime import datetime
 import psutil
-import re
 
 
 monitor = get_monitors()[0]
@@ -47,24 +52,6 @@ height = monitor.height - 50
 path_to_font = "/home/kallatt/Documents/Fonts/PragmataPro_Mono_R_liga_0826.ttf"
 
 
-def gst(location):
-    cwd = os.getcwd()
-    os.chdir(location)
-    res = subprocess.check_output(['git', 'status'])
-    res = res.decode('utf-8')
-    os.chdir(cwd)
-
-    gst_bits = {k: False for k in "!?*+>x"}
-
-    for line in res.split("\n"):
-        for key, grep in zip(list("!?*+>x"), ["modified:", "Untracked files", "Your branch is ahead of",
-                                              "new file:", "renamed:", "deleted:"]):
-            if grep in line:
-                gst_bits[key] = True
-
-    return "".join([k for k, v in gst_bits.items() if v])
-
-
 def get_ram_usage():
     """
     Obtains the absolute number of RAM bytes currently in use by the system.
@@ -74,27 +61,68 @@ def get_ram_usage():
     return int(psutil.virtual_memory().total - psutil.virtual_memory().available)
 
 
+@instrumentation.timed("psutil")
+def system_usage_text():
+    """ RAM and CPU bars of the 'ps aux' panel. """
+    mem_bytes = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')  # e.g. 4015976448
+    mem_gib = mem_bytes / (1024. ** 3)  # e.g. 3.74
+    ram_usage = get_ram_usage() / (1024. ** 3)
+
+    cfo = psutil.cpu_freq()
+    cpu_freq = cfo.current / 1000
+    cpu_count = psutil.cpu_count()
+
+    cpu_freq_text = f"ClkSpd {cpu_freq:.2f}GHz"
+    cpu_count_text = f"CPUCores: {cpu_count}"
+
+    bar_len = 25
+
+    ram_index = int(bar_len * ram_usage / mem_gib)
+    cpu_index = int(bar_len * (cpu_freq * 1000 - cfo.min) / (cfo.max - cfo.min))
+
+    return "\n".join([
+        f"RAM |{('#' * ram_index).ljust(bar_len)}| {ram_usage:.1f} / {mem_gib:.1f} GiB RAM Used.",
+        f"CPU |{('#' * cpu_index).ljust(bar_len)}| {cpu_freq_text}, {cpu_count_text}",
+    ])
+
+
 opened_state = True
+status_cache = StatusCache(interval=10.0, watcher=ProjectWatcher().start()).start()
+view_model = PanelViewModel(db_file, status_cache)
 git_activity = gitlog.plot_git_activity()
 project_registration_sheet = None
 project_removal_verification = None
+git_job = None  # commit / pull running in the background.
+git_job_output = deque(maxlen=8)
 
-cwd = os.getcwd()
-cloc_res = subprocess.check_output(["cloc", "--exclude-dir=venv", "--json", "--include-ext=py", "--by-file", cwd])
-cloc_res = json.loads(cloc_res)
+cloc_res = "counting lines..."
 
-cloc_res = {k[len(cwd):] if k.startswith(cwd) else k: v for k, v in cloc_res.items() if k != "header"}
 
-files = list(cloc_res.keys())
-cloc_res = {cat: [cloc_res[k].get(cat, None) for k in files] for cat in ['blank', 'comment', 'code', 'language']}
-cloc_res = {'files': files, **cloc_res}
+def count_lines_forever(interval=30.0):
+    """ keep cloc_res up to date with the line counts of every registered project. """
+    global cloc_res
+    while True:
+        # a failed count (eg. the database stayed locked, or a project was removed mid count) is retried on
+        # the next round, instead of ending the thread and leaving the panel stale.
+        try:
+            with DatabaseObject(db_file) as dbo:
+                roots = [row['project_location'] for row in dbo.iter_projects()
+                         if os.path.isdir(row['project_location'])]
+            counts = line_counter.count_lines(roots)
+            summary = line_counter.summarize(counts, by="project", roots=roots)
+            summary['files'] = summary['files'].apply(
+                lambda x: x if x == "SUM" else f"~/{os.path.relpath(x, os.path.expanduser('~'))}")
+            cloc_res = summary.to_string(index=False)
+        except Exception as error:
+            print(f"Could not count lines: {error!r}")
+        time.sleep(interval)
+
 
-cloc_res = pd.DataFrame(cloc_res)
-cloc_res.set_index('files')
+threading.Thread(target=count_lines_forever, name="LineCounter", daemon=True).start()
 
 
 def frame_commands():
-    global git_activity, project_registration_sheet, project_removal_verification, cloc_res
+    global git_activity, project_registration_sheet, project_removal_verification, cloc_res, git_job
     GL.glClearColor(0.06, 0.1, 0.2, 1)
     GL.glClear(GL.GL_COLOR_BUFFER_BIT)
 
@@ -119,39 +147,16 @@ def frame_commands():
     imgui.set_next_window_position(x_positions[column_index], 50)
     imgui.begin("Project List", flags=restricted_with_scroll)
     imgui.text("Open Project...\n---------------")
-    with DatabaseObject(db_file) as dbo:
-        cats = dbo.get_categories()
-        for project_row in dbo.get_projects():
-            name = project_row['project_name']
-            loc = project_row['project_location']
-            cat_id = project_row['category_id']
-            vcs_upstream = project_row['vcs_upstream']
-
-            status = gst(loc)
-            if status:
-                status = f" ({status})"
-
-            if vcs_upstream is None:
-                vcs_upstream = "Local"
-            else:
-                pattern = re.compile(r"https://github.com/([^/]+)/([^/]+)\.git")
-                match = re.match(pattern, vcs_upstream)
-                if match is not None:
-                    vcs_upstream = "{"+f"GitHub->{match.group(2)}"+"}"
-
-            vcs_upstream = f"Upstream: {vcs_upstream}"
-            button_text = [
-                cats.get(cat_id, "-") + ": " + name,
-                f"\t~/{os.path.relpath(loc, os.path.expanduser('~'))}",
-                f"\t{vcs_upstream}{status}"
-            ]
-            if imgui.button("\n".join(button_text)):
-                cwd = os.getcwd()
-                os.chdir(loc)
-                os.system(f"gnome-terminal")
-                os.chdir(cwd)
+    view_model.update()
+    for loc, button_text in view_model.project_list():
+        if imgui.button(button_text):
+            cwd = os.getcwd()
+            os.chdir(loc)
+            os.system(f"gnome-terminal")
+            os.chdir(cwd)
 
     imgui.end()
+    instrumentation.lap("panel Project List")
 
     # column 2
     column_index += 1
@@ -159,66 +164,65 @@ def frame_commands():
     imgui.set_next_window_position(x_positions[column_index], 50)
     imgui.begin("ps aux", flags=restricted_flags)
 
-    mem_bytes = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')  # e.g. 4015976448
-    mem_gib = mem_bytes / (1024. ** 3)  # e.g. 3.74
-    ram_usage = get_ram_usage() / (1024. ** 3)
-
-    cfo = psutil.cpu_freq()
-    cpu_freq = cfo.current / 1000
-    cpu_count = psutil.cpu_count()
-
-    cpu_freq_text = f"ClkSpd {cpu_freq:.2f}GHz"
-    cpu_count_text = f"CPUCores: {cpu_count}"
-
-    bar_len = 25
-
-    ram_index = int(bar_len * ram_usage / mem_gib)
-    cpu_index = int(bar_len * (cpu_freq * 1000 - cfo.min) / (cfo.max - cfo.min))
-
-    imgui.text(f"RAM |{('#' * ram_index).ljust(bar_len)}| {ram_usage:.1f} / {mem_gib:.1f} GiB RAM Used.")
-    imgui.text(f"CPU |{('#' * cpu_index).ljust(bar_len)}| {cpu_freq_text}, {cpu_count_text}")
+    imgui.text(view_model.throttled("ps aux", system_usage_text))
 
     imgui.end()
+    instrumentation.lap("panel ps aux")
 
     imgui.set_next_window_size(column_widths[column_index], 300)
     imgui.set_next_window_position(x_positions[column_index], 180)
     imgui.begin("code commit", flags=restricted_flags)
 
-    if imgui.button(" - Commit Code - "):
-        cwd = os.getcwd()
+    job_running = git_job is not None and not git_job.done
+
+    if imgui.button(" - Commit Code - ") and not job_running:
         now = datetime.now().strftime("%y/%m/%d - %H:%M:%S")
-        with DatabaseObject(db_file) as dbo:
-            for project_row in dbo.get_projects():
-                loc = project_row['project_location']
-                vcs_upstream = project_row['vcs_upstream']
+        steps_by_location = {}
+        for project_row in view_model.project_rows:
+            loc = project_row['project_location']
+            vcs_upstream = project_row['vcs_upstream']
+
+            if os.path.isdir(f"{loc}/.git"):
+                steps = git_jobs.commit_steps(f"autocompile {now}")
+                if vcs_upstream is not None:
+                    steps += git_jobs.push_steps()
+                steps_by_location[loc] = steps
+            else:
+                print(f"no .git in {loc}")
 
-                if ".git" in os.listdir(loc):
-                    os.chdir(loc)
-                    os.system(f"git add --all; git commit -m \"autocompile {now}\"")
+        git_job_output.clear()
+        git_job = git_jobs.GitJob(steps_by_location).start()
 
-                    if vcs_upstream is not None:
-                        os.system("git push")
+    if imgui.button(" - Pull Code - ") and not job_running:
+        steps_by_location = {}
+        for project_row in view_model.project_rows:
+            loc = project_row['project_location']
+            vcs_upstream = project_row['vcs_upstream']
+            if vcs_upstream is not None:
+                if os.path.isdir(f"{loc}/.git"):
+                    steps_by_location[loc] = git_jobs.pull_steps()
                 else:
                     print(f"no .git in {loc}")
 
-        os.chdir(cwd)
+        git_job_output.clear()
+        git_job = git_jobs.GitJob(steps_by_location).start()
 
-    if imgui.button(" - Pull Code - "):
-        cwd = os.getcwd()
-        with DatabaseObject(db_file) as dbo:
-            for project_row in dbo.get_projects():
-                loc = project_row['project_location']
-                vcs_upstream = project_row['vcs_upstream']
-                if vcs_upstream is not None:
-                    if ".git" in os.listdir(loc):
-                        os.chdir(loc)
-                        os.system("git pull")
-                    else:
-                        print(f"no .git in {loc}")
+    if git_job is not None:
+        for event in git_job.drain():
+            if event.result is None:
+                git_job_output.append(f"{os.path.basename(event.location)}: {event.line}")
+            else:
+                status_cache.refresh(event.location)
+                if event.result.returncode is None and not git_job.cancelled:
+                    git_job_output.append(f"{os.path.basename(event.location)}: timed out")
+
+        if not git_job.done and imgui.button(" - Cancel - "):
+            git_job.cancel()
 
-        os.chdir(cwd)
+    imgui.text("\n".join(git_job_output))
 
     imgui.end()
+    instrumentation.lap("panel code commit")
 
     imgui.set_next_window_size(column_widths[column_index], 300)
     imgui.set_next_window_position(x_positions[column_index], 530)
@@ -253,10 +257,12 @@ def frame_commands():
         if successful:
             with DatabaseObject(db_file) as dbo:
                 dbo.register_project(**json_obj)
+            view_model.invalidate()
 
         project_registration_sheet = None
 
     imgui.end()
+    instrumentation.lap("panel project registration")
 
     imgui.set_next_window_size(column_widths[column_index], height - 980)
     imgui.set_next_window_position(x_positions[column_index], 880)
@@ -270,8 +276,10 @@ def frame_commands():
     if imgui.button("Remove Project"):
         with DatabaseObject(db_file) as dbo:
             dbo.remove_project(project_removal_verification)
+        view_model.invalidate()
 
     imgui.end()
+    instrumentation.lap("panel project removal")
 
     # column 3
     column_index += 1
@@ -280,10 +288,10 @@ def frame_commands():
     imgui.set_next_window_position(x_positions[column_index], 50)
     imgui.begin("dbo_info", flags=restricted_with_scroll)
 
-    with DatabaseObject(db_file) as dbo:
-        imgui.text(str(dbo))
+    imgui.text(view_model.dbo_text)
 
     imgui.end()
+    instrumentation.lap("panel dbo_info")
 
     # column 4
     column_index += 1
@@ -292,9 +300,10 @@ def frame_commands():
     imgui.set_next_window_position(x_positions[column_index], height-450)
     imgui.begin("cloc", flags=restricted_flags)
 
-    imgui.text(str(cloc_res))
+    imgui.text(cloc_res)
 
     imgui.end()
+    instrumentation.lap("panel cloc")
 
     # column 5
     column_index += 1
@@ -306,6 +315,14 @@ def frame_commands():
     fmt = now.strftime("%y/%m/%d - %H:%M:%S")
     imgui.text(f"{fmt} -- {io.framerate:.2f}fps")
     imgui.end()
+    instrumentation.lap("panel clock")
+
+    imgui.set_next_window_size(column_widths[column_index], 300)
+    imgui.set_next_window_position(x_positions[column_index], 120)
+    imgui.begin("frame budget", flags=restricted_flags)
+    imgui.text(view_model.throttled("frame budget", instrumentation.frame_report, 0.5))
+    imgui.end()
+    instrumentation.lap("panel frame budget")
 
     imgui.set_next_window_size(column_widths[column_index], 700)
     imgui.set_next_window_position(x_positions[column_index], height-750)
@@ -313,9 +330,11 @@ def frame_commands():
     imgui.begin("Git History", flags=restricted_flags)
     imgui.text(git_activity)
     imgui.end()
+    instrumentation.lap("panel Git History")
 
 
 def render_frame(impl, window, font):
+    instrumentation.begin_frame()
     glfw.poll_events()
     impl.process_inputs()
     imgui.new_frame()
@@ -332,8 +351,10 @@ def render_frame(impl, window, font):
         imgui.pop_font()
 
     imgui.render()
-    impl.render(imgui.get_draw_data())
-    glfw.swap_buffers(window)
+    with instrumentation.span("render"):
+        impl.render(imgui.get_draw_data())
+        glfw.swap_buffers(window)
+    instrumentation.end_frame()
 
 
 def impl_glfw_init():
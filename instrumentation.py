@@ -0,0 +1,172 @@
+"""
+Lightweight timing of the hot paths, kept in memory as rolling percentiles.
+
+Code marks what it spends time on with spans:
+    with span("git status"):
+        ...
+or by decorating a function with @timed(). The last SPAN_WINDOW durations of each span are kept, from
+which percentiles are computed when a report is asked for.
+
+The GUI brackets each frame with begin_frame() / end_frame() and marks the end of each panel with lap(),
+so panels and the spans run on the render thread during a frame add up to a per-frame breakdown
+(frame_report) against FRAME_BUDGET.
+
+Setting PMK_INSTRUMENT=0 turns every span into a no-op.
+"""
+import atexit
+import functools
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+ENABLED = os.getenv("PMK_INSTRUMENT", "1") != "0"
+SPAN_WINDOW = int(os.getenv("PMK_SPAN_WINDOW", 512))  # durations kept per span.
+FRAME_BUDGET = 1000 / 60  # milliseconds a frame can take at 60fps.
+PERCENTILES = (50, 95, 99)
+
+_lock = threading.Lock()
+span_durations = {}  # name -> deque of the last SPAN_WINDOW durations, in milliseconds
+span_counts = {}  # name -> number of times the span ran
+
+_frame_thread = None  # the thread frames are rendered on
+_frame_start = None
+_last_lap = None
+current_frame = {}  # name -> milliseconds spent in the span during the frame being rendered
+last_frame = {}  # the same for the last complete frame, along with "frame" for the whole frame
+
+
+def record(name, milliseconds):
+    with _lock:
+        durations = span_durations.get(name, None)
+        if durations is None:
+            durations = span_durations[name] = deque(maxlen=SPAN_WINDOW)
+        durations.append(milliseconds)
+        span_counts[name] = span_counts.get(name, 0) + 1
+    if _frame_start is not None and threading.get_ident() == _frame_thread:
+        current_frame[name] = current_frame.get(name, 0.0) + milliseconds
+
+
+class span:
+    """ context manager timing a block of code under a name. """
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if ENABLED:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.start is not None:
+            record(self.name, (time.perf_counter() - self.start) * 1000)
+            self.start = None
+
+
+def timed(name=None):
+    """ decorator timing every call of a function, under its qualified name by default. """
+    def decorator(func):
+        span_name = name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(span_name, (time.perf_counter() - start) * 1000)
+        return wrapper
+    return decorator
+
+
+def begin_frame():
+    global _frame_thread, _frame_start, _last_lap
+    _frame_thread = threading.get_ident()
+    current_frame.clear()
+    _frame_start = _last_lap = time.perf_counter()
+
+
+def lap(name):
+    """ record the time since the frame began or the last lap under a name, eg. once per GUI panel. """
+    global _last_lap
+    if _last_lap is None or not ENABLED:
+        return
+    now = time.perf_counter()
+    record(name, (now - _last_lap) * 1000)
+    _last_lap = now
+
+
+def end_frame():
+    global _frame_start, _last_lap, last_frame
+    if _frame_start is None:
+        return
+    frame_ms = (time.perf_counter() - _frame_start) * 1000
+    _frame_start = _last_lap = None
+    last_frame = dict(current_frame)
+    last_frame["frame"] = frame_ms
+    record("frame", frame_ms)
+
+
+def percentiles(name, points=PERCENTILES):
+    """ {point: milliseconds} of the recent durations of a span, or None if it never ran. """
+    with _lock:
+        durations = sorted(span_durations.get(name, ()))
+    if not durations:
+        return None
+    return {point: durations[min(len(durations) - 1, len(durations) * point // 100)] for point in points}
+
+
+def summary():
+    """ (name, count, {percentile: ms}, max ms) of every span, the slowest (by p95) first. """
+    with _lock:
+        names = list(span_durations.keys())
+    rows = []
+    for name in names:
+        with _lock:
+            durations = list(span_durations[name])
+            count = span_counts[name]
+        rows.append((name, count, percentiles(name), max(durations)))
+    rows.sort(key=lambda row: row[2][95], reverse=True)
+    return rows
+
+
+def report():
+    """ text table of summary() """
+    rows = summary()
+    if not rows:
+        return "no spans recorded."
+    width = max(len(row[0]) for row in rows)
+    header = f"{'span'.ljust(width)} {'count':>7} " + " ".join(f"{'p' + str(p):>9}" for p in PERCENTILES)
+    lines = [header + f" {'max':>9}"]
+    for name, count, points, longest in rows:
+        lines.append(f"{name.ljust(width)} {count:>7} " + " ".join(f"{points[p]:>7.2f}ms" for p in PERCENTILES)
+                     + f" {longest:>7.2f}ms")
+    return "\n".join(lines)
+
+
+def frame_report():
+    """ where the last frame's time went, each span with its recent p95, against the frame budget. """
+    frame = dict(last_frame)
+    if not frame:
+        return "no frames recorded."
+    frame_ms = frame.pop("frame")
+    lines = [f"frame {frame_ms:6.2f}ms / {FRAME_BUDGET:.1f}ms budget"]
+    for name, milliseconds in sorted(frame.items(), key=lambda item: item[1], reverse=True):
+        p95 = (percentiles(name) or {}).get(95, 0.0)
+        lines.append(f"  {name[:28].ljust(28)} {milliseconds:6.2f}ms  p95 {p95:6.2f}ms")
+    return "\n".join(lines)
+
+
+def print_report():
+    print(report(), file=sys.stderr)
+
+
+def dump_on_exit():
+    """ print the report to stderr when the process exits, for --profile. """
+    atexit.register(print_report)
@@ -0,0 +1,102 @@
+"""
+Module state computed on first use instead of at import time.
+
+Importing a module should not touch the database or the file system, so that the command line tool
+reaches its first prompt quickly. State is wrapped in a `lazy_state` function instead, computed on first
+call and cached until refreshed.
+
+Profiling startup:
+    python lazy_state.py [module ...]
+times a fresh import of each module against STARTUP_BUDGET, and setting PMK_PROFILE_STARTUP=1 prints the
+time spent computing each piece of lazy state when the process exits.
+"""
+import atexit
+import functools
+import os
+import subprocess
+import sys
+import threading
+import time
+
+PROFILE_STARTUP = bool(os.getenv("PMK_PROFILE_STARTUP"))
+STARTUP_BUDGET = float(os.getenv("PMK_STARTUP_BUDGET", 0.25))  # seconds, per module import.
+
+# (name, seconds) of each piece of lazy state computed so far.
+state_timings = []
+
+
+def lazy_state(func):
+    """
+    Cache the result of a function of no arguments, computing it on first call.
+
+    The wrapped function gets two hooks:
+        func.refresh() recomputes the state and returns it.
+        func.invalidate() drops the cached state, it is recomputed on next call.
+    """
+    lock = threading.Lock()
+    cache = []
+
+    @functools.wraps(func)
+    def wrapper():
+        if not cache:
+            with lock:
+                if not cache:
+                    start = time.perf_counter()
+                    cache.append(func())
+                    state_timings.append((f"{func.__module__}.{func.__name__}", time.perf_counter() - start))
+        return cache[0]
+
+    def invalidate():
+        with lock:
+            cache.clear()
+
+    def refresh():
+        invalidate()
+        return wrapper()
+
+    wrapper.invalidate = invalidate
+    wrapper.refresh = refresh
+    return wrapper
+
+
+def print_state_timings():
+    for name, seconds in state_timings:
+        print(f"{name}: {seconds * 1000:.1f}ms", file=sys.stderr)
+
+
+if PROFILE_STARTUP:
+    atexit.register(print_state_timings)
+
+
+def import_time(module):
+    """ seconds it takes to import a module in a fresh interpreter. """
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    res = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    if res.returncode != 0:
+        return None
+    return float(res.stdout.decode('utf-8').strip())
+
+
+def profile_imports(modules):
+    """
+    Print the import time of each module against the startup budget.
+
+    :returns: True if every module imported within budget.
+    """
+    within_budget = True
+    for module in modules:
+        seconds = import_time(module)
+        if seconds is None:
+            print(f"{module}: failed to import")
+            within_budget = False
+            continue
+        over = seconds > STARTUP_BUDGET
+        within_budget &= not over
+        print(f"{module}: {seconds * 1000:.1f}ms{' (over budget)' if over else ''}")
+    return within_budget
+
+
+if __name__ == '__main__':
+    startup_modules = sys.argv[1:] or ["database_api", "gitlog", "cmd_line_file", "project_config"]
+    sys.exit(0 if profile_imports(startup_modules) else 1)
@@ -0,0 +1,237 @@
+"""
+Counts blank, comment and code lines of source files, in place of shelling out to cloc.
+
+Counts are cached in the database per file, keyed by path, size and modification time, so counting a
+tree again only reads the files that changed since. Files that need counting are spread over a process
+pool when there are enough of them.
+"""
+import multiprocessing
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from database_api import DatabaseObject, db_file
+
+LineCount = namedtuple("LineCount", ["language", "blank", "comment", "code"])
+
+# extension -> (language, line comment markers, block comment delimiters)
+LANGUAGES = {
+    ".py": ("Python", ("#",), (('"""', '"""'), ("'''", "'''"))),
+    ".java": ("Java", ("//",), (("/*", "*/"),)),
+    ".c": ("C", ("//",), (("/*", "*/"),)),
+    ".h": ("C/C++ Header", ("//",), (("/*", "*/"),)),
+    ".cpp": ("C++", ("//",), (("/*", "*/"),)),
+    ".js": ("JavaScript", ("//",), (("/*", "*/"),)),
+    ".css": ("CSS", (), (("/*", "*/"),)),
+    ".html": ("HTML", (), (("<!--", "-->"),)),
+    ".sh": ("Bourne Shell", ("#",), ()),
+}
+DEFAULT_EXTENSIONS = (".py",)
+EXCLUDE_DIRS = {"venv", ".venv", ".git", "__pycache__", "node_modules"}
+
+# below this many changed files, counting in this process is quicker than starting a pool.
+POOL_THRESHOLD = 256
+
+
+def string_end(text, end=None, delimiters=('"""', "'''")):
+    """
+    Delimiter of the python triple quoted string still open at the end of some text, or None.
+
+    :param end: Delimiter of a string already open at the start of the text.
+    """
+    pos = 0
+    while True:
+        if end is not None:
+            index = text.find(end, pos)
+            if index == -1:
+                return end
+            pos = index + len(end)
+            end = None
+        else:
+            found = [(index, delimiter) for index, delimiter in
+                     ((text.find(delimiter, pos), delimiter) for delimiter in delimiters) if index != -1]
+            if not found:
+                return None
+            index, end = min(found)
+            pos = index + len(end)
+
+
+def count_file(path):
+    """
+    Count the blank, comment and code lines of a source file.
+
+    Python docstrings count as comments, like cloc does, but other triple quoted strings (opened after
+    code on the same line) count as code. A line holding both code and a comment counts as code.
+    """
+    language, line_markers, block_markers = LANGUAGES[os.path.splitext(path)[1]]
+    blank = comment = code = 0
+    block_end = None  # end delimiter of the block comment we are in, if any.
+    code_string_end = None  # end delimiter of the python string (not docstring) we are in, if any.
+
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as source:
+            for line in source:
+                stripped = line.strip()
+                if code_string_end is not None:
+                    if stripped:
+                        code += 1
+                    else:
+                        blank += 1
+                    code_string_end = string_end(stripped, code_string_end)
+                    continue
+                if block_end is not None:
+                    if block_end not in stripped:
+                        comment += 1
+                        continue
+                    # the block comment ends on this line, anything after it is counted like a line of its own.
+                    stripped = stripped[stripped.index(block_end) + len(block_end):].strip()
+                    block_end = None
+                    if not stripped or stripped.startswith(line_markers):
+                        comment += 1
+                        continue
+
+                if not stripped:
+                    blank += 1
+                    continue
+                if stripped.startswith(line_markers):
+                    comment += 1
+                    continue
+
+                # string prefixes of a python docstring, eg. r""" or f"""
+                opener = stripped.lstrip("rRuUfFbB") if language == "Python" else stripped
+                for start, end in block_markers:
+                    if opener.startswith(start):
+                        comment += 1
+                        if end not in opener[len(start):]:
+                            block_end = end
+                        break
+                    if language == "Python":
+                        continue
+                    if start in stripped:
+                        # code followed by a block comment that carries on to the next lines.
+                        if end not in stripped[stripped.index(start) + len(start):]:
+                            block_end = end
+                else:
+                    code += 1
+                    if language == "Python":
+                        # a string opened after code, eg. SQL = """, is code up to where it closes.
+                        code_string_end = string_end(stripped)
+    except OSError:
+        pass
+
+    return LineCount(language, blank, comment, code)
+
+
+def source_files(root, extensions=DEFAULT_EXTENSIONS, exclude_dirs=EXCLUDE_DIRS):
+    """ (path, size, mtime_ns) of the source files under a directory. """
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = [d for d in dir_names if d not in exclude_dirs]
+        for file_name in file_names:
+            if os.path.splitext(file_name)[1] not in extensions:
+                continue
+            path = os.path.join(dir_path, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            yield path, stat.st_size, stat.st_mtime_ns
+
+
+def count_all(paths, processes=None):
+    """
+    count many files, spread across a process pool if there are enough of them.
+
+    The pool is only used from the main thread. Its workers are spawned rather than forked, since a fork of
+    a process running other threads can leave the workers holding locks no thread will release, and
+    spawned workers import the main module again, which gui_file doesn't allow. gui_file counts from a
+    background thread, so it counts in process.
+    """
+    if len(paths) < POOL_THRESHOLD or threading.current_thread() is not threading.main_thread():
+        return [count_file(path) for path in paths]
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        return list(executor.map(count_file, paths, chunksize=32))
+
+
+def count_lines(roots, extensions=DEFAULT_EXTENSIONS, exclude_dirs=EXCLUDE_DIRS, processes=None, file=db_file):
+    """
+    Count the lines of every source file under some directories, re-reading only files that changed.
+
+    :param roots: Directories to count.
+    :param extensions: File extensions to count, see LANGUAGES.
+    :param exclude_dirs: Directory names not to descend into.
+    :param processes: Size of the process pool, defaults to the number of CPUs.
+    :param file: Database holding the cached counts.
+    :returns: {path: LineCount}
+    """
+    counts = {}
+    with DatabaseObject(file) as dbo:
+        for root in roots:
+            root = os.path.abspath(root)
+            cached = dbo.get_line_counts(root)
+
+            found = set()
+            stale = []
+            for path, size, mtime_ns in source_files(root, extensions, exclude_dirs):
+                entry = cached.get(path, None)
+                if entry is not None and entry[:2] == (size, mtime_ns):
+                    counts[path] = LineCount(*entry[2:])
+                else:
+                    stale.append((path, size, mtime_ns))
+                found.add(path)
+
+            fresh = count_all([path for path, _, _ in stale], processes=processes)
+            for (path, _, _), line_count in zip(stale, fresh):
+                counts[path] = line_count
+
+            dbo.set_line_counts([(path, size, mtime_ns, *line_count)
+                                 for (path, size, mtime_ns), line_count in zip(stale, fresh)])
+            dbo.remove_line_counts([path for path in cached.keys() if path not in found])
+
+    return counts
+
+
+def summarize(counts, by="language", roots=None):
+    """
+    Totals of count_lines in the shape cloc's json output was reshaped into.
+
+    :param counts: The result of count_lines.
+    :param by: 'language', 'file' or 'project' (the root each file is under).
+    :param roots: The roots counted, paths are shown relative to them when grouping by file or project.
+    :returns: DataFrame with files, blank, comment, code and language columns, and a final SUM row.
+    """
+    import pandas as pd
+
+    roots = sorted([os.path.abspath(root) for root in roots or []], key=len, reverse=True)
+
+    def root_of(path):
+        for root in roots:
+            if path.startswith(root + os.sep):
+                return root
+        return None
+
+    totals = {}
+    for path, line_count in sorted(counts.items()):
+        if by == "language":
+            key, language = line_count.language, None
+        elif by == "file":
+            root = root_of(path)
+            key, language = (path if root is None else path[len(root):]), line_count.language
+        elif by == "project":
+            key, language = root_of(path) or os.path.dirname(path), None
+        else:
+            raise ValueError(f"unknown grouping {repr(by)}")
+
+        blank, comment, code = totals.get(key, (0, 0, 0))[:3]
+        totals[key] = (blank + line_count.blank, comment + line_count.comment, code + line_count.code, language)
+
+    totals["SUM"] = tuple(sum(t[i] for t in totals.values()) for i in range(3)) + (None,)
+
+    files = list(totals.keys())
+    frame = pd.DataFrame({
+        'files': files,
+        **{cat: [totals[k][i] for k in files] for i, cat in enumerate(['blank', 'comment', 'code', 'language'])}
+    })
+    return frame
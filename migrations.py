@@ -0,0 +1,145 @@
+"""
+Schema migrations, run in place on a database when it's opened.
+
+A database records how many migrations it has had in PRAGMA user_version. Opening it runs the pending
+ones, in order, in the same write transaction as the rest of the schema bootstrap (see
+DatabaseObject.bootstrap_schema), so every process sees either none or all of them.
+
+Migrations change what table_rows can't: indexes, new columns of existing tables, data fixes. They run
+against every database, fresh or old, so they must do nothing if their change is already there, eg.
+CREATE INDEX IF NOT EXISTS, or add_column. Only ever append to the list, the position of a migration is
+its revision.
+
+A fresh database file of a new version (dbfiles/<version>/cms.db) starts as a bulk copy of the newest
+older version's file, see copy_database.
+
+    python migrations.py [--file FILE] [--copy-from OLD_FILE]
+"""
+import argparse
+import os
+import sqlite3
+
+migrations = []
+
+
+def migration(func):
+    """ add a migration, after every migration defined before it. """
+    migrations.append(func)
+    return func
+
+
+def add_column(dbo, table_name, column):
+    """ add a column to a table unless it already has it, column is its definition, eg. 'notes TEXT'. """
+    if column.split(" ")[0] not in dbo.get_table_cols(table_name):
+        dbo.conn.execute(f"ALTER TABLE {table_name} ADD COLUMN {column};")
+        dbo.conn.table_schemas.pop(table_name, None)
+
+
+@migration
+def index_projects(dbo):
+    """ index projects by category and by modification time, for listings filtered or sorted by them. """
+    dbo.conn.execute("CREATE INDEX IF NOT EXISTS projects_category_id ON projects (category_id);")
+    dbo.conn.execute("CREATE INDEX IF NOT EXISTS projects_modified ON projects (modified);")
+
+
+@migration
+def recount_block_comment_ends(dbo):
+    """ drop cached line counts, lines with code after the end of a block comment were counted as comments. """
+    dbo.conn.execute("DELETE FROM line_counts;")
+
+
+@migration
+def recount_python_strings(dbo):
+    """ drop cached line counts, python strings opened after code on a line were counted as docstrings. """
+    dbo.conn.execute("DELETE FROM line_counts;")
+
+
+def schema_revision(dbo):
+    return dbo.conn.execute("PRAGMA user_version;").fetchone()[0]
+
+
+def is_migrated(dbo):
+    return schema_revision(dbo) >= len(migrations)
+
+
+def migrate(dbo):
+    """
+    Run the migrations a database hasn't had yet, in a write transaction.
+
+    :returns: The number of migrations run.
+    """
+    with dbo.transaction():
+        revision = schema_revision(dbo)
+        for func in migrations[revision:]:
+            func(dbo)
+        if revision < len(migrations):
+            dbo.conn.execute(f"PRAGMA user_version = {len(migrations)};")
+    return max(0, len(migrations) - revision)
+
+
+def previous_version_file(file):
+    """ database file of the newest older version next to a versioned file, or None. """
+    from database_api import versions
+
+    file = os.path.abspath(file)
+    version_dir = os.path.dirname(file)
+    current = os.path.basename(version_dir)
+    if current not in versions:
+        return None
+
+    for old_version in reversed(versions[:versions.index(current)]):
+        old_file = os.path.join(os.path.dirname(version_dir), old_version, os.path.basename(file))
+        if os.path.exists(old_file):
+            return old_file
+    return None
+
+
+def copy_database(dbo, old_file):
+    """
+    Copy every row of another database file into a database, in a write transaction.
+
+    Tables are copied in the order of table_rows, so rows are copied before the rows referring to them,
+    along with their ids. Columns the other file doesn't have are left to their defaults, and tables or
+    columns this schema doesn't have are skipped. Rows clashing with a row already there are skipped.
+
+    :returns: {table name: rows copied}
+    """
+    from database_api import table_rows, insert_query
+
+    old_conn = sqlite3.connect(f"file:{old_file}?mode=ro", uri=True)
+    copied = {}
+    try:
+        old_tables = {row[0] for row in old_conn.execute("SELECT name FROM sqlite_master WHERE type = 'table';")}
+        with dbo.transaction():
+            for table_name in table_rows.keys():
+                if table_name not in old_tables:
+                    continue
+                old_cols = {row[1] for row in old_conn.execute(f"PRAGMA table_info({table_name});")}
+                cols = tuple(col for col in dbo.get_table_cols(table_name) if col in old_cols)
+                rows = old_conn.execute(f"SELECT {', '.join(cols)} FROM {table_name};")
+                before = dbo.conn.total_changes
+                dbo.conn.executemany(insert_query(table_name, cols, or_ignore=True), rows)
+                copied[table_name] = dbo.conn.total_changes - before
+    finally:
+        old_conn.close()
+    return copied
+
+
+def main():
+    from database_api import DatabaseObject, db_file
+
+    parser = argparse.ArgumentParser(description="Migrate a project manager database to the current schema.")
+    parser.add_argument("--file", default=db_file, help="database file to migrate")
+    parser.add_argument("--copy-from", help="database file to copy every row from, eg. of an older version")
+    args = parser.parse_args()
+
+    # opening the database runs the pending migrations.
+    with DatabaseObject(args.file) as dbo:
+        print(f"{args.file}: schema revision {schema_revision(dbo)} of {len(migrations)}.")
+        if args.copy_from is not None:
+            for table_name, count in copy_database(dbo, args.copy_from).items():
+                print(f"Copied {count} row{'s' * (count != 1)} into {table_name}.")
+
+
+if __name__ == '__main__':
+    main()
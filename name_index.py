@@ -0,0 +1,115 @@
+"""
+In-memory index of the registered project names, for the command line prompt.
+
+The prompt validates and completes project names on every keystroke, so names are read from the database
+once into a set, for O(1) lookups, and a prefix trie, for completion. The index is reloaded when the
+projects table may have changed: after invalidate(), or when another connection or process committed to
+the database, noticed through PRAGMA data_version.
+"""
+import threading
+
+from database_api import DatabaseObject, DataVersionWatcher
+
+
+class PrefixTrie:
+    """ words by prefix, complete() costs the length of the prefix plus the number of completions. """
+    __slots__ = ("root", "size")
+
+    END = ""  # key marking the end of a word, every other key is a single character.
+
+    def __init__(self, words=()):
+        self.root = {}
+        self.size = 0
+        for word in words:
+            self.insert(word)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, word):
+        node = self._find(word)
+        return node is not None and PrefixTrie.END in node
+
+    def _find(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.get(char, None)
+            if node is None:
+                return None
+        return node
+
+    def insert(self, word):
+        node = self.root
+        for char in word:
+            node = node.setdefault(char, {})
+        if PrefixTrie.END not in node:
+            node[PrefixTrie.END] = True
+            self.size += 1
+
+    def remove(self, word):
+        path = [self.root]
+        for char in word:
+            node = path[-1].get(char, None)
+            if node is None:
+                return
+            path.append(node)
+        if path[-1].pop(PrefixTrie.END, None) is None:
+            return
+        self.size -= 1
+
+        # drop the nodes only this word used.
+        for char, node in zip(reversed(word), reversed(path)):
+            if node:
+                break
+            path[len(path) - 2].pop(char)
+            path.pop()
+
+    def complete(self, prefix, limit=None):
+        """ words starting with a prefix, in sorted order, at most `limit` of them. """
+        node = self._find(prefix)
+        if node is None:
+            return []
+
+        words = []
+        stack = [(prefix, node)]
+        while stack and (limit is None or len(words) < limit):
+            word, node = stack.pop()
+            if PrefixTrie.END in node:
+                words.append(word)
+            stack += [(word + char, node[char]) for char in sorted(node.keys(), reverse=True) if char]
+        return words
+
+
+class ProjectNameIndex:
+    """ the registered project names of a database, as a set and a prefix trie, loaded on first use. """
+    def __init__(self, file):
+        self.file = file
+        self._lock = threading.Lock()
+        self._names = None
+        self._trie = None
+        self._db_watcher = DataVersionWatcher(file)
+
+    def invalidate(self):
+        """ reload the names on next use, eg. after registering, updating or removing a project. """
+        with self._lock:
+            self._names = None
+            self._trie = None
+
+    def _load(self):
+        with self._lock:
+            if self._db_watcher.changed() or self._names is None:
+                with DatabaseObject(self.file) as dbo:
+                    names = [row[0] for row in dbo.conn.execute("SELECT project_name FROM projects;")]
+                self._names = set(names)
+                self._trie = PrefixTrie(names)
+            return self._names, self._trie
+
+    def names(self):
+        return self._load()[0]
+
+    def __contains__(self, project_name):
+        return project_name in self._load()[0]
+
+    def complete(self, prefix, limit=None):
+        """ project names starting with a prefix, in sorted order. """
+        return self._load()[1].complete(prefix, limit)
@@ -1,47 +1,114 @@
 from __future__ import annotations
 
 
+LABEL_COLORS = {
+    "Feature Request": "#22ff22",
+    "Refactor": "#eeee22",
+    "Hard Problem": "#ff8822",
+    "Bug Fix": "#ff2222",
+    "Documentation": "#2222ff"
+}
+# label bit of each label, by lower case name. computed once instead of on every ProjectLabels.
+LABEL_BITS = {label.lower(): 1 << i for i, label in enumerate(LABEL_COLORS.keys())}
+ALL_LABELS = (1 << len(LABEL_COLORS)) - 1
+
+
+def iter_bits(code):
+    """ each set bit of a label code, lowest first. """
+    while code:
+        bit = code & -code
+        yield bit
+        code ^= bit
+
+
+class LabelNames:
+    """ ProjectLabels.labels is the {label: color} dict, and on a ProjectLabels the set of its labels. """
+    def __get__(self, instance, owner):
+        if instance is None:
+            return LABEL_COLORS
+        return {label for label, bit in zip(LABEL_COLORS.keys(), LABEL_BITS.values()) if instance.code() & bit}
+
+
 class ProjectLabels:
-    labels = {
-        "Feature Request": "#22ff22",
-        "Refactor": "#eeee22",
-        "Hard Problem": "#ff8822",
-        "Bug Fix": "#ff2222",
-        "Documentation": "#2222ff"
-    }
+    """ a set of task labels, held as a bitmask of LABEL_BITS. """
+    __slots__ = ("_code",)
+    labels = LabelNames()
 
     def __init__(self, *labels):
-        self.labels = {" ".join(map(str.capitalize, l.split(" ")))
-                       for l in labels if l.lower() in map(str.lower, ProjectLabels.labels.keys())}
+        code = 0
+        for label in labels:
+            code |= LABEL_BITS.get(label.lower(), 0)
+        self._code = code
 
     def __or__(self, other: ProjectLabels):
-        return ProjectLabels(self.labels.union(other.labels))
+        return ProjectLabels.from_code(self._code | other._code)
 
     def __and__(self, other: ProjectLabels):
-        return ProjectLabels(self.labels.intersection(other.labels))
+        return ProjectLabels.from_code(self._code & other._code)
+
+    def __eq__(self, other):
+        return isinstance(other, ProjectLabels) and self._code == other._code
+
+    def __hash__(self):
+        return self._code
 
     def __str__(self):
         return str(self.labels)
 
     @staticmethod
     def rows():
-        return [{"label": label, "color": color} for label, color in ProjectLabels.labels.items()]
+        return [{"label": label, "color": color} for label, color in LABEL_COLORS.items()]
 
     def code(self):
-        return sum([(1 << i) * int(x in self.labels) for i, x in enumerate(ProjectLabels.labels.keys())])
+        return self._code
 
     @classmethod
     def from_code(cls, code):
-        return ProjectLabels(*{label for i, label in enumerate(ProjectLabels.labels.keys()) if code & (1 << i)})
+        labels = object.__new__(cls)
+        labels._code = code & ALL_LABELS
+        return labels
 
 
 class Card:
+    __slots__ = ("card_name", "contents", "labels")
+
     def __init__(self, card_name, contents, labels):
         self.card_name = card_name
         self.contents = contents
         self.labels = labels
 
 
+class BoardLists(dict):
+    """
+    Lists of a board stored in the database, {list name: [Card]}.
+
+    The cards of a list are only read from the database the first time the list is used, so opening a
+    board with many cards only reads the list names.
+    """
+    def __init__(self, load_list, list_names):
+        super().__init__({list_name: None for list_name in list_names})
+        self._load_list = load_list
+
+    def is_loaded(self, list_name):
+        return dict.get(self, list_name) is not None
+
+    def __getitem__(self, list_name):
+        cards = super().__getitem__(list_name)
+        if cards is None:
+            cards = self._load_list(list_name)
+            super().__setitem__(list_name, cards)
+        return cards
+
+    def get(self, list_name, default=None):
+        return self[list_name] if list_name in self else default
+
+    def values(self):
+        return [self[list_name] for list_name in self]
+
+    def items(self):
+        return [(list_name, self[list_name]) for list_name in self]
+
+
 class ProjectBoard:
     def __init__(self, board_name):
         self.name = board_name
@@ -49,6 +116,88 @@ class ProjectBoard:
             "To Do": [],
             "Completed": []
         }
+        self.file = None  # database the board is stored in, if any.
+        self._list_ids = {}  # list name -> list_id in the database
+
+        # list name -> {label bit (0 for unlabelled cards) -> {id(card): card}}, built for a list when first
+        # filtered and kept up to date by the methods below; cards should be added and removed through them.
+        self._label_index = {}
+        self._card_order = {}  # id(card) -> when it was added, to give matches back in list order.
+        self._next_order = 0
+
+    @classmethod
+    def load(cls, board_name, file=None):
+        """ a board stored in the database, or None. the cards of each list are read when first used. """
+        from database_api import DatabaseObject, db_file  # database_api imports this module.
+
+        file = db_file if file is None else file
+        with DatabaseObject(file) as dbo:
+            board_id = dbo.get_board_id(board_name)
+            if board_id is None:
+                return None
+            list_rows = dbo.get_board_lists(board_id)
+
+        board = cls(board_name)
+        board.file = file
+        board._list_ids = {list_name: list_id for list_id, list_name in list_rows}
+        board.lists = BoardLists(board._load_list, board._list_ids.keys())
+        return board
+
+    def save(self, file=None):
+        """ store the board in the database, lists that were never loaded are left as they are. """
+        from database_api import DatabaseObject, db_file
+
+        file = (self.file or db_file) if file is None else file
+        lists = {}
+        for list_name in self.lists.keys():
+            if file == self.file and isinstance(self.lists, BoardLists) and not self.lists.is_loaded(list_name):
+                lists[list_name] = None
+            else:
+                lists[list_name] = [(card.card_name, card.contents, card.labels.code())
+                                    for card in self.lists[list_name]]
+
+        with DatabaseObject(file) as dbo:
+            _, self._list_ids = dbo.save_board(self.name, lists)
+        self.file = file
+
+    def _load_list(self, list_name):
+        return self._query_cards([list_name])[list_name]
+
+    def _query_cards(self, list_names, label=None, exact=True):
+        """ {list name: [Card]} read from the database, optionally only cards with some labels. """
+        from database_api import DatabaseObject
+
+        list_names = {self._list_ids[list_name]: list_name for list_name in list_names}
+        cards = {list_name: [] for list_name in list_names.values()}
+        label_code = None if label is None else label.code()
+        with DatabaseObject(self.file) as dbo:
+            for list_id, card_name, contents, code in dbo.get_cards(list_names.keys(), label_code, exact):
+                cards[list_names[list_id]].append(Card(card_name, contents, ProjectLabels.from_code(code)))
+        return cards
+
+    def _index_card(self, index, card):
+        self._card_order[id(card)] = self._next_order
+        self._next_order += 1
+        for bit in iter_bits(card.labels.code()) if card.labels.code() else [0]:
+            index.setdefault(bit, {})[id(card)] = card
+
+    def _unindex_card(self, list_name, card):
+        index = self._label_index.get(list_name, None)
+        if index is None:
+            return
+        self._card_order.pop(id(card), None)
+        for bit in iter_bits(card.labels.code()) if card.labels.code() else [0]:
+            index.get(bit, {}).pop(id(card), None)
+
+    def _list_index(self, list_name):
+        """ label index of a list, built on first use. """
+        index = self._label_index.get(list_name, None)
+        if index is None:
+            index = {}
+            for card in self.lists[list_name]:
+                self._index_card(index, card)
+            self._label_index[list_name] = index
+        return index
 
     def add_list(self, list_name):
         if list_name in self.lists.keys():
@@ -57,25 +206,62 @@ class ProjectBoard:
 
     def remove_list(self, list_name):
         if list_name in self.lists.keys():
-            self.lists.pop(list_name)
+            for card in self.lists.pop(list_name) or []:
+                self._unindex_card(list_name, card)
+            self._label_index.pop(list_name, None)
 
     def add_card(self, list_name: str, card: Card):
         self.lists[list_name].append(card)
+        if list_name in self._label_index:
+            self._index_card(self._label_index[list_name], card)
 
     def remove_card(self, list_name: str, card_index: int):
         if list_name not in self.lists.keys():
             return
         card = self.lists[list_name][card_index]
-        self.lists[list_name].remove(card)
+        self.remove(list_name, card)
 
     def remove(self, list_name: str, card: Card):
         if list_name not in self.lists.keys():
             return
         self.lists[list_name].remove(card)
+        self._unindex_card(list_name, card)
+
+    def _matches(self, list_name, code, exact):
+        """ cards of a loaded list with exactly / any of the labels of a code, found through the label index. """
+        index = self._list_index(list_name)
+        if exact:
+            # look through the cards of the label with the fewest cards only.
+            candidates = min([index.get(bit, {}) for bit in iter_bits(code)] or [index.get(0, {})], key=len)
+            return [card for card in candidates.values() if card.labels.code() == code]
+
+        buckets = [index[bit] for bit in iter_bits(code) if bit in index]
+        if len(buckets) == 1:
+            return list(buckets[0].values())
+        matches = {}
+        for cards in buckets:
+            matches.update(cards)
+        return sorted(matches.values(), key=lambda card: self._card_order[id(card)])
 
     def filter_by_label(self, label: ProjectLabels, exact: bool = True):
-        label_filter = {
-            True: lambda x: x.labels.code() == label.code(),
-            False: lambda x: x.labels.code() & label.code()
-        }[exact]
-        return {ln: filter(label_filter, ls) for ln, ls in self.lists.items()}
+        # lists not loaded yet are filtered by the database, without reading their other cards.
+        unloaded = []
+        if isinstance(self.lists, BoardLists):
+            unloaded = [ln for ln in self.lists.keys() if not self.lists.is_loaded(ln)]
+        filtered = self._query_cards(unloaded, label, exact) if unloaded else {}
+
+        code = label.code()
+        return {ln: filtered[ln] if ln in filtered else self._matches(ln, code, exact)
+                for ln in self.lists.keys()}
+
+    def count_label(self, label: ProjectLabels, exact: bool = False):
+        """ {list name: number of cards with the label(s)}, loading lists as needed. """
+        code = label.code()
+        counts = {}
+        for list_name in self.lists.keys():
+            bits = list(iter_bits(code))
+            if not exact and len(bits) == 1:
+                counts[list_name] = len(self._list_index(list_name).get(bits[0], {}))
+            else:
+                counts[list_name] = len(self._matches(list_name, code, exact))
+        return counts
@@ -1,13 +1,37 @@
+import copy
 import json
 import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from lazy_state import lazy_state
 
 HOME_FOLDER = os.path.expanduser('~')
-PROJECTS_FOLDERS = []
 ORIGINAL_CWD = os.getcwd()
+CONFIG_NAME = ".project_config"
+CONFIG_WORKERS = int(os.getenv("PMK_CONFIG_WORKERS", 8))
+
+# config file -> ((mtime_ns, size), raw text, parsed json), so unchanged configs aren't read again.
+config_cache = {}
+config_cache_lock = threading.Lock()
+
+
+@lazy_state
+def get_projects_folders():
+    """ git repositories directly inside ~/PycharmProjects, if there is such a folder. """
+    projects_root = HOME_FOLDER + "/PycharmProjects"
+    if not os.path.isdir(projects_root):
+        return []
+    return [f"{projects_root}/{fp}" for fp in sorted(os.listdir(projects_root))
+            if os.path.exists(f"{projects_root}/{fp}/.git")]
 
-for fp in os.listdir(HOME_FOLDER + "/PycharmProjects"):
-    if os.path.exists(HOME_FOLDER + f"/PycharmProjects/{fp}/.git"):
-        PROJECTS_FOLDERS.append(HOME_FOLDER + f"/PycharmProjects/{fp}")
+
+def __getattr__(name):
+    # PROJECTS_FOLDERS is looked up on first use, refresh with get_projects_folders.refresh()
+    if name == "PROJECTS_FOLDERS":
+        return get_projects_folders()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def check_activated(func):
@@ -20,29 +44,124 @@ def check_activated(func):
     return wrapper
 
 
+def config_key(stat):
+    return stat.st_mtime_ns, stat.st_size
+
+
+def read_config(config_file):
+    """
+    Raw text and parsed json of a config file, read once and cached until the file changes.
+
+    :returns: (raw text, json data), the json data is a copy the caller can change. (None, None) if
+        there is no such file.
+    """
+    try:
+        key = config_key(os.stat(config_file))
+    except OSError:
+        return None, None
+
+    with config_cache_lock:
+        cached = config_cache.get(config_file, None)
+    if cached is None or cached[0] != key:
+        with open(config_file, 'r') as config:
+            config_data = config.read()
+        try:
+            json_data = json.loads(config_data)
+        except json.decoder.JSONDecodeError as error:
+            print(error)
+            json_data = {}
+        cached = (key, config_data, json_data)
+        with config_cache_lock:
+            config_cache[config_file] = cached
+
+    return cached[1], copy.deepcopy(cached[2])
+
+
+def write_config(config_file, json_data):
+    """ replace a config file atomically, readers see either the old or the new config, never half of it. """
+    config_data = json.dumps(json_data)
+    fd, temp_file = tempfile.mkstemp(prefix=CONFIG_NAME, dir=os.path.dirname(config_file))
+    try:
+        try:
+            os.chmod(temp_file, os.stat(config_file).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(temp_file, 0o644)
+        with os.fdopen(fd, 'w') as config:
+            config.write(config_data)
+            config.flush()
+            os.fsync(config.fileno())
+        os.replace(temp_file, config_file)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+    with config_cache_lock:
+        config_cache[config_file] = (config_key(os.stat(config_file)), config_data, copy.deepcopy(json_data))
+    return config_data
+
+
+def load_configs(locations, workers=None):
+    """
+    Read the configs of many projects at once.
+
+    :returns: {location: json data}, for the projects that have a config file.
+    """
+    locations = list(locations)
+    if not locations:
+        return {}
+
+    def load(location):
+        return read_config(f"{os.path.abspath(location)}/{CONFIG_NAME}")[1]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers or CONFIG_WORKERS, len(locations)))) as executor:
+        configs = executor.map(load, locations)
+        return {location: json_data for location, json_data in zip(locations, configs) if json_data is not None}
+
+
+def load_project_configs(file=None):
+    """ configs of every registered project, see load_configs. """
+    from database_api import DatabaseObject, db_file
+
+    with DatabaseObject(db_file if file is None else file) as dbo:
+        locations = [project_row['project_location'] for project_row in dbo.iter_projects()]
+    return load_configs(locations)
+
+
+def settings_text(json_data):
+    """ one line summary of a project's settings for the status views. """
+    return ", ".join(f"{key}: {value}" for key, value in json_data.items())
+
+
 class ProjectConfigObject:
     def __init__(self, project_fp: str):
-        self.config_file = f"{os.path.abspath(project_fp)}/.project_config"
+        self.config_file = f"{os.path.abspath(project_fp)}/{CONFIG_NAME}"
         self.activated = os.path.exists(self.config_file)
         self.config_data = "{}"
         self.json_data = {}
+        self._saved_data = {}  # json data as last read or written, to tell if it changed.
+
+    @property
+    def dirty(self):
+        return self.json_data != self._saved_data
 
     @check_activated
     def open_data(self):
-        with open(self.config_file, 'r') as config_file:
-            self.config_data = config_file.read()
-        with open(self.config_file, 'r') as config_file:
-            try:
-                self.json_data = json.load(config_file)
-            except json.decoder.JSONDecodeError as error:
-                print(error)
-                self.json_data = {}
+        config_data, json_data = read_config(self.config_file)
+        if config_data is None:
+            raise Exception("Project has no config file.")
+        self.config_data = config_data
+        self.json_data = json_data
+        self._saved_data = copy.deepcopy(json_data)
 
     def write_data(self):
+        """ write the config, only if it changed since it was read. """
         if self.json_data is None:
             self.json_data = {}
-        with open(self.config_file, 'w') as config_file:
-            json.dump(self.json_data, config_file)
+        if self.activated and not self.dirty:
+            return
+        self.config_data = write_config(self.config_file, self.json_data)
+        self.activated = True
+        self._saved_data = copy.deepcopy(self.json_data)
 
     def __enter__(self):
         self.open_data()
@@ -63,7 +182,7 @@ class ProjectConfigObject:
 
 
 if __name__ == '__main__':
-    proj_fp = PROJECTS_FOLDERS[0]
+    proj_fp = get_projects_folders()[0]
     print(proj_fp)
 
     with ProjectConfigObject(proj_fp) as pco:
@@ -0,0 +1,164 @@
+"""
+Finds the git projects under some root directories and registers them all at once.
+
+Roots are walked level by level, the directories of a level listed concurrently. A directory holding a
+.git is a project and isn't descended into, and neither are virtual environments, node_modules and
+hidden directories. The listing of every directory is cached in the database along with its mtime, so
+a rescan only lists the directories that gained or lost entries since, and only stats the rest.
+
+The roots default to ~/PycharmProjects, and can be set with PMK_DISCOVERY_ROOTS (separated like PATH).
+"""
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from database_api import DatabaseObject, db_file
+
+HOME_FOLDER = os.path.expanduser('~')
+DISCOVERY_ROOTS = os.getenv("PMK_DISCOVERY_ROOTS", f"{HOME_FOLDER}/PycharmProjects").split(os.pathsep)
+DISCOVERY_WORKERS = int(os.getenv("PMK_DISCOVERY_WORKERS", 16))
+MAX_DEPTH = 8
+
+PRUNE_DIRS = {"venv", ".venv", "env", "node_modules", "__pycache__", "site-packages"}
+
+# children are the names of the sub directories worth scanning.
+ScannedDir = namedtuple("ScannedDir", ["mtime_ns", "children", "is_project"])
+
+
+def scan_dir(path, cached=None):
+    """
+    List a directory, unless it hasn't changed since it was cached.
+
+    :returns: (ScannedDir, or None if the directory can't be read, True if it had to be listed)
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return None, False
+    if cached is not None and cached.mtime_ns == mtime_ns:
+        return cached, False
+
+    children = []
+    is_project = False
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name == ".git":
+                    is_project = True
+                elif entry.name[0] != "." and entry.name not in PRUNE_DIRS:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            children.append(entry.name)
+                    except OSError:
+                        continue
+    except OSError:
+        return None, False
+
+    if is_project:
+        children = []
+    return ScannedDir(mtime_ns, tuple(sorted(children)), is_project), True
+
+
+def discover_projects(roots=None, workers=None, max_depth=MAX_DEPTH, file=db_file):
+    """
+    Locations of the git projects under some directories.
+
+    :param roots: Directories to search, DISCOVERY_ROOTS by default.
+    :param workers: Number of directories listed at once.
+    :param max_depth: How many directories deep below a root to look for projects.
+    :param file: Database holding the cached directory listings.
+    """
+    roots = [os.path.abspath(root) for root in (DISCOVERY_ROOTS if roots is None else roots)]
+    roots = [root for root in roots if os.path.isdir(root)]
+    if not roots:
+        return []
+
+    with DatabaseObject(file) as dbo:
+        cache = {}
+        for root in roots:
+            cache.update({path: ScannedDir(*row) for path, row in dbo.get_scanned_dirs(root).items()})
+
+    projects = []
+    listed = []
+    seen = set()
+    with ThreadPoolExecutor(max_workers=workers or DISCOVERY_WORKERS) as executor:
+        level = roots
+        for depth in range(max_depth + 1):
+            if not level:
+                break
+            scans = executor.map(lambda path: scan_dir(path, cache.get(path, None)), level)
+
+            next_level = []
+            for path, (scanned, was_listed) in zip(level, scans):
+                if scanned is None or path in seen:
+                    continue
+                seen.add(path)
+                if was_listed:
+                    listed.append((path, *scanned))
+                if scanned.is_project:
+                    projects.append(path)
+                elif depth < max_depth:
+                    next_level += [os.path.join(path, child) for child in scanned.children]
+            level = next_level
+
+    with DatabaseObject(file) as dbo:
+        dbo.set_scanned_dirs(listed)
+        dbo.remove_scanned_dirs([path for path in cache.keys() if path not in seen])
+
+    return sorted(projects)
+
+
+def read_upstream(location):
+    """ url of a project's origin remote, read from .git/config without running git. """
+    section = None
+    try:
+        with open(os.path.join(location, ".git", "config"), 'r') as config:
+            for line in config:
+                line = line.strip()
+                if line.startswith("["):
+                    section = line
+                elif section == '[remote "origin"]' and line.startswith("url"):
+                    key, _, value = line.partition("=")
+                    if key.strip() == "url":
+                        return value.strip()
+    except OSError:
+        pass
+    return None
+
+
+def register_discovered(roots=None, category_id=None, file=db_file):
+    """
+    Register every project found under some directories that isn't registered yet.
+
+    Projects are named after their directory, or their path below the root where that name is taken,
+    followed by a number if that is taken too.
+
+    :returns: The number of projects registered.
+    """
+    roots = [os.path.abspath(root) for root in (DISCOVERY_ROOTS if roots is None else roots)]
+    locations = discover_projects(roots, file=file)
+
+    with DatabaseObject(file) as dbo:
+        taken_names = set()
+        registered = set()
+        for project_row in dbo.iter_projects():
+            taken_names.add(project_row['project_name'])
+            registered.add(project_row['project_location'])
+
+        projects = []
+        for location in locations:
+            if location in registered:
+                continue
+            name = os.path.basename(location)
+            if name in taken_names:
+                root = next((root for root in roots if location.startswith(root + os.sep)), None)
+                name = location if root is None else os.path.relpath(location, root)
+            base_name, suffix = name, 2
+            while name in taken_names:
+                name = f"{base_name} ({suffix})"
+                suffix += 1
+            taken_names.add(name)
+            projects.append({"project_name": name, "project_location": location,
+                             "vcs_upstream": read_upstream(location), "category_id": category_id})
+
+        return dbo.register_projects(projects)
@@ -0,0 +1,248 @@
+"""
+Watches registered projects for changes on disk, so their git status is only recomputed when they change.
+
+On Linux each project's working tree and its .git directory (HEAD, index, refs) are watched with inotify.
+Events are debounced, a project is only reported dirty once its files have been quiet for `debounce`
+seconds. Where inotify isn't available, or the watch limit is reached, projects are reported as unwatched
+and callers keep polling them.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+# directories of the working tree not worth watching, .git is watched separately.
+WATCH_EXCLUDE_DIRS = {".git", "venv", ".venv", "node_modules", "__pycache__"}
+
+
+def load_inotify():
+    """ libc with the inotify functions, or None if this system doesn't have them. """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class ProjectWatcher:
+    """
+    Keeps track of which projects changed on disk.
+
+    set_locations() chooses the projects to watch, take_dirty() returns the projects that changed since
+    the last call. on_dirty, if given, is called from the watcher thread with each project that changes.
+    """
+    def __init__(self, debounce=0.5, on_dirty=None):
+        self.debounce = debounce
+        self.on_dirty = on_dirty
+
+        self._libc = load_inotify()
+        self._fd = None
+        self._lock = threading.Lock()
+        self._watches = {}  # watch descriptor -> (location, directory)
+        self._location_watches = {}  # location -> watch descriptors
+        self._unwatched = set()  # locations that couldn't be watched.
+        self._pending = {}  # location -> time of the last event, not yet quiet for `debounce`.
+        self._dirty = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+        if self._libc is not None:
+            fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                self._fd = fd
+
+    @property
+    def available(self):
+        """ False if inotify isn't available, every project is then unwatched. """
+        return self._fd is not None
+
+    def is_watched(self, location):
+        with self._lock:
+            return location in self._location_watches and location not in self._unwatched
+
+    def set_locations(self, locations):
+        """ watch these project locations, and stop watching any other. """
+        locations = set(locations)
+        with self._lock:
+            current = set(self._location_watches.keys()) | self._unwatched
+        for location in current - locations:
+            self._unwatch(location)
+        for location in locations - current:
+            self._watch(location)
+
+    def _add_watch(self, location, directory):
+        """ :returns: False if the directory couldn't be watched because of the watch limit. """
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            return ctypes.get_errno() != errno.ENOSPC
+        with self._lock:
+            self._watches[wd] = (location, directory)
+            self._location_watches.setdefault(location, set()).add(wd)
+        return True
+
+    def _watch_tree(self, location, root, exclude_dirs):
+        for dir_path, dir_names, _ in os.walk(root):
+            dir_names[:] = [d for d in dir_names if d not in exclude_dirs]
+            if not self._add_watch(location, dir_path):
+                return False
+        return True
+
+    def _watch(self, location):
+        if not self.available or not os.path.isdir(location):
+            with self._lock:
+                self._unwatched.add(location)
+            return
+
+        with self._lock:
+            self._location_watches.setdefault(location, set())
+
+        git_dir = os.path.join(location, ".git")
+        watched = (self._watch_tree(location, location, WATCH_EXCLUDE_DIRS) and
+                   self._add_watch(location, git_dir) and
+                   self._watch_tree(location, os.path.join(git_dir, "refs"), set()))
+        if not watched:
+            self._unwatch(location)
+            with self._lock:
+                self._unwatched.add(location)
+
+    def _unwatch(self, location):
+        with self._lock:
+            self._unwatched.discard(location)
+            self._pending.pop(location, None)
+            self._dirty.discard(location)
+            wds = self._location_watches.pop(location, set())
+            for wd in wds:
+                self._watches.pop(wd, None)
+        for wd in wds:
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def mark_dirty(self, location):
+        with self._lock:
+            self._pending.pop(location, None)
+            self._dirty.add(location)
+        if self.on_dirty is not None:
+            self.on_dirty(location)
+
+    def take_dirty(self, include_pending=True):
+        """
+        Projects that changed since the last call.
+
+        :param include_pending: If True, include projects that changed but haven't been quiet for long enough.
+        """
+        with self._lock:
+            dirty = set(self._dirty)
+            self._dirty.clear()
+            if include_pending:
+                dirty |= set(self._pending.keys())
+                self._pending.clear()
+        return dirty
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 1 << 16)
+        except BlockingIOError:
+            return
+        now = time.monotonic()
+
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, name_len = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + name_len].rstrip(b"\0")
+            offset += EVENT_HEADER.size + name_len
+
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, so any project could have changed.
+                with self._lock:
+                    for location in self._location_watches.keys():
+                        self._pending[location] = now
+                continue
+
+            with self._lock:
+                watch = self._watches.get(wd, None)
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+                if watch is not None:
+                    self._pending[watch[0]] = now
+            if watch is None:
+                continue
+
+            if not (mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO)):
+                continue
+
+            # watch new directories too, inotify watches aren't recursive.
+            location, directory = watch
+            new_dir = os.path.join(directory, os.fsdecode(name))
+            parts = os.path.relpath(new_dir, location).split(os.sep)
+            if parts[0] != ".git":
+                if not WATCH_EXCLUDE_DIRS.intersection(parts):
+                    self._watch_tree(location, new_dir, WATCH_EXCLUDE_DIRS)
+            elif len(parts) > 2 and parts[1] == "refs":
+                self._watch_tree(location, new_dir, set())
+
+    def _flush_pending(self):
+        """ report projects whose files have been quiet for `debounce` seconds. """
+        now = time.monotonic()
+        with self._lock:
+            quiet = [loc for loc, last in self._pending.items() if now - last >= self.debounce]
+        for location in quiet:
+            self.mark_dirty(location)
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                waiting = bool(self._pending)
+            readable, _, _ = select.select([self._fd], [], [], self.debounce / 2 if waiting else 1.0)
+            if readable:
+                self._read_events()
+            self._flush_pending()
+
+    def start(self):
+        if self.available and (self._thread is None or not self._thread.is_alive()):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="ProjectWatcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,169 @@
+"""
+Stress test of the database layer shared by many processes, like the GUI and command line sessions are.
+
+    python stress_db.py [--writers W] [--readers R] [--seconds S] [--hold MS]
+
+Against a fresh database file in a temporary directory:
+ - W + R processes open it at the same moment, racing to bootstrap the schema.
+ - For S seconds, the W writers register, update and remove projects, sometimes holding the write lock
+   for MS milliseconds, while the R readers list the projects and time each listing.
+Reports errors such as 'database is locked', and fails if the schema wasn't bootstrapped exactly once or
+if a reader ever waited as long as a writer held the lock, ie. readers were blocked behind a writer.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+
+def open_db(file, start, errors):
+    """ open the database once every process is ready, racing the others to bootstrap it. """
+    from database_api import DatabaseObject
+
+    start.wait()
+    try:
+        with DatabaseObject(file):
+            pass
+    except Exception as error:
+        errors.append(f"bootstrap: {error!r}")
+
+
+def writer(index, file, root, start, seconds, hold, results):
+    from database_api import DatabaseObject
+
+    errors = []
+    open_db(file, start, errors)
+    writes = 0
+    deadline = time.monotonic() + seconds
+    i = 0
+    while time.monotonic() < deadline:
+        name = f"writer_{index}_{i}"
+        location = os.path.join(root, "projects", name)
+        os.makedirs(location, exist_ok=True)
+        try:
+            with DatabaseObject(file) as dbo:
+                dbo.register_project(name, location)
+                dbo.update_project(name, vcs_upstream=f"https://example.com/{name}.git")
+                if i % 5 == 0:
+                    # a slow write, too big for the page cache so pages are written to the file (or the WAL)
+                    # before the commit. readers shouldn't notice it.
+                    dbo.conn.execute("PRAGMA cache_size=-64;")
+                    with dbo.transaction():
+                        dbo.conn.execute("UPDATE projects SET project_board = ?;", (name * 400,))
+                        time.sleep(hold / 1000)
+                    dbo.conn.execute("PRAGMA cache_size=-2000;")
+                if i % 3 == 0:
+                    dbo.remove_project(name)
+            writes += 1
+        except Exception as error:
+            errors.append(f"writer {index}: {error!r}")
+        i += 1
+    results.put({"role": "writer", "writes": writes, "errors": errors})
+
+
+def reader(index, file, start, seconds, results):
+    from database_api import DatabaseObject
+
+    errors = []
+    open_db(file, start, errors)
+    latencies = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        began = time.perf_counter()
+        try:
+            with DatabaseObject(file) as dbo:
+                dbo.get_projects()
+        except Exception as error:
+            errors.append(f"reader {index}: {error!r}")
+            continue
+        latencies.append((time.perf_counter() - began) * 1000)
+    results.put({"role": "reader", "latencies": latencies, "errors": errors})
+
+
+def run(writers, readers, seconds, hold):
+    """ run the stress test, :returns: (report dict, list of failures) """
+    import project_board.project_board as proboard
+
+    # spawned processes start without connections inherited from this one.
+    context = multiprocessing.get_context("spawn")
+    root = tempfile.mkdtemp(prefix="pmk_stress_")
+    file = os.path.join(root, "cms.db")
+    try:
+        start = context.Event()
+        results = context.Queue()
+        processes = [context.Process(target=writer, args=(i, file, root, start, seconds, hold, results))
+                     for i in range(writers)]
+        processes += [context.Process(target=reader, args=(i, file, start, seconds, results))
+                      for i in range(readers)]
+        for process in processes:
+            process.start()
+        # give every process time to import before letting them all open the database at once.
+        time.sleep(1.0)
+        start.set()
+
+        reports = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        conn = sqlite3.connect(file)
+        label_count = conn.execute("SELECT COUNT(*) FROM task_labels;").fetchone()[0]
+        journal_mode = conn.execute("PRAGMA journal_mode;").fetchone()[0]
+        conn.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    errors = [error for report in reports for error in report["errors"]]
+    latencies = sorted(ms for report in reports if report["role"] == "reader" for ms in report["latencies"])
+    writes = sum(report.get("writes", 0) for report in reports)
+    report = {
+        "params": {"writers": writers, "readers": readers, "seconds": seconds, "hold_ms": hold},
+        "journal_mode": journal_mode,
+        "task_labels": label_count,
+        "writes": writes,
+        "reads": len(latencies),
+        "errors": errors[:20],
+        "error_count": len(errors),
+    }
+    if latencies:
+        report["read_ms"] = {
+            "median": round(statistics.median(latencies), 3),
+            "p99": round(latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)], 3),
+            "max": round(latencies[-1], 3),
+        }
+
+    failures = []
+    if errors:
+        failures.append(f"{len(errors)} errors")
+    if label_count != len(proboard.ProjectLabels.labels):
+        failures.append(f"{label_count} task labels seeded, expected {len(proboard.ProjectLabels.labels)}")
+    if writers and not writes:
+        failures.append("no writes went through")
+    if readers and not latencies:
+        failures.append("no reads went through")
+    if writers and latencies and latencies[-1] >= hold:
+        failures.append(f"a read took {latencies[-1]:.1f}ms, as long as a writer holds the lock")
+    return report, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress the database with concurrent reader and writer processes.")
+    parser.add_argument("--writers", type=int, default=4, help="writer processes")
+    parser.add_argument("--readers", type=int, default=4, help="reader processes")
+    parser.add_argument("--seconds", type=float, default=10.0, help="how long to run for")
+    parser.add_argument("--hold", type=float, default=200.0, help="milliseconds slow writes hold the write lock")
+    args = parser.parse_args()
+
+    report, failures = run(args.writers, args.readers, args.seconds, args.hold)
+    report["failures"] = failures
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,8 @@ Features I want:
  - Assigning priority to tasks
  - Label task dependencies
 """
+import heapq
+import text_layout
 from datetime import date
 from dataclasses import dataclass
 
@@ -16,46 +18,372 @@ class Task:
     description: str
     start: date
     end: date = None
+    project: str = None
+
+    def duration(self):
+        """ length of the task in days, tasks without an end are milestones of no length. """
+        if self.end is None:
+            return 0
+        return max(0, (self.end - self.start).days)
 
     def __str__(self):
-        lines = [
-            self.name,
-            self.start.strftime("%Y / %m / %d"),
-            "-" * len(self.name)
-        ]
-        if self.end is not None:
-            lines[1] += " --- " + self.end.strftime("%Y / %m / %d")
-
-        desc_width = 40
-        description = self.description.split(" ")
-
-        line = []
-
-        while description:
-            word = description.pop(0)
-            if len(" ".join(line)) + len(word) + 1 > desc_width:
-                if len(" ".join(line)) < desc_width - 3:
-                    # hyphenate
-                    ll = desc_width - len(" ".join(line)) - 1
-                    line.append(word[:ll] + "-")
-                    word = word[ll:]
-
-                lines.append(" ".join(line))
-                line = [word]
-            else:
-                line += [word]
+        return text_layout.task_block(self)
 
-        lines.append(" ".join(line))
 
-        return "\n".join(lines)
+class TaskScheduler:
+    """
+    Tasks and the dependencies between them, scheduled with the critical path method.
 
+    A task starts no earlier than its start date and lasts task.duration() days. A dependency
+    `before -> after` with a lag of n days means `after` starts at least n days after `before` ends,
+    like the Gantt chart responsibilities that start some time after another one. Tasks are keyed by
+    name, and a task's latest start is measured against the finish of its project.
 
-class TaskScheduler:
+    Dependencies are kept acyclic, along with a topological order that is patched locally when an edge
+    goes against it. Scheduled dates are recomputed incrementally: after a change only the tasks whose
+    dates can move are visited, in topological order. Change task dates through set_dates().
+    """
     def __init__(self):
-        self.tasks = []
+        self.tasks = {}  # name -> Task
+
+        self._succs = {}  # name -> {successor: lag}
+        self._preds = {}  # name -> {predecessor: lag}
+        self._position = {}  # name -> position in a topological order
+        self._next_position = 0
+        self._order = None  # cached topological order
+
+        # schedule, as date ordinals.
+        self._release = {}  # name -> start ordinal of the task itself
+        self._duration = {}
+        self._es = {}  # earliest start
+        self._ef = {}  # earliest finish
+        self._ls = {}  # latest start
+        self._project_tasks = {}  # project -> names
+        self._horizon = {}  # project -> earliest finish of the whole project
+
+        self._dirty_forward = set()  # tasks whose earliest start may have changed
+        self._dirty_backward = set()  # tasks whose latest start may have changed
+        self._stale_projects = set()  # projects whose finish must be looked up again
+
+    def _add_node(self, task):
+        name = task.name
+        self.tasks[name] = task
+        self._succs[name] = {}
+        self._preds[name] = {}
+        self._position[name] = self._next_position
+        self._next_position += 1
+        self._release[name] = task.start.toordinal()
+        self._duration[name] = task.duration()
+        self._project_tasks.setdefault(task.project, set()).add(name)
+        self._dirty_forward.add(name)
+        self._dirty_backward.add(name)
+        self._order = None
+
+    def schedule_task(self, task: Task, after=()) -> bool:
+        """
+        Add a task, optionally after other tasks.
+
+        :returns: False if a task of the same name is already scheduled.
+        """
+        if task.name in self.tasks:
+            return False
+        self._add_node(task)
+        for before in after:
+            self.add_dependency(before, task.name)
+        return True
+
+    def schedule_tasks(self, tasks, dependencies=()) -> bool:
+        """
+        Add many tasks and dependencies at once, in a single O(V + E) pass.
+
+        :param tasks: Tasks to add, names must not be scheduled already.
+        :param dependencies: (before, after) or (before, after, lag) name tuples.
+        :returns: False, without changing anything, if a name is taken or unknown, or the dependencies
+            form a cycle.
+        """
+        tasks = list(tasks)
+        names = {task.name for task in tasks}
+        if len(names) != len(tasks) or any(name in self.tasks for name in names):
+            return False
+
+        edges = [(dep[0], dep[1], dep[2] if len(dep) > 2 else 0) for dep in dependencies]
+        known = names | self.tasks.keys()
+        if any(before not in known or after not in known or before == after for before, after, _ in edges):
+            return False
+
+        # Kahn's algorithm over the existing and new dependencies, in the current order where possible.
+        in_degree = {name: len(preds) for name, preds in self._preds.items()}
+        in_degree.update({name: 0 for name in names})
+        new_succs = {}
+        for before, after, _ in edges:
+            if after not in self._succs.get(before, {}) and after not in new_succs.get(before, set()):
+                new_succs.setdefault(before, set()).add(after)
+                in_degree[after] += 1
+
+        ready = [name for name in self.topological_order() if in_degree[name] == 0]
+        ready += [task.name for task in tasks if in_degree[task.name] == 0]
+        ready.reverse()
+        order = []
+        while ready:
+            name = ready.pop()
+            order.append(name)
+            for succs in (self._succs.get(name, ()), new_succs.get(name, ())):
+                for succ in succs:
+                    in_degree[succ] -= 1
+                    if in_degree[succ] == 0:
+                        ready.append(succ)
+        if len(order) != len(in_degree):
+            return False
+
+        for task in tasks:
+            self._add_node(task)
+        for before, after, lag in edges:
+            self._succs[before][after] = lag
+            self._preds[after][before] = lag
+            self._dirty_forward.add(after)
+            self._dirty_backward.add(before)
+        self._position = {name: position for position, name in enumerate(order)}
+        self._next_position = len(order)
+        self._order = order
+        return True
+
+    def remove_task(self, name):
+        if name not in self.tasks:
+            return
+        for pred in self._preds.pop(name):
+            self._succs[pred].pop(name)
+            self._dirty_backward.add(pred)
+        for succ in self._succs.pop(name):
+            self._preds[succ].pop(name)
+            self._dirty_forward.add(succ)
+
+        task = self.tasks.pop(name)
+        self._project_tasks[task.project].discard(name)
+        self._stale_projects.add(task.project)
+        for state in (self._position, self._release, self._duration, self._es, self._ef, self._ls):
+            state.pop(name, None)
+        self._dirty_forward.discard(name)
+        self._dirty_backward.discard(name)
+        self._order = None
+
+    def add_dependency(self, before, after, lag=0) -> bool:
+        """
+        Make a task start at least `lag` days after another one ends.
+
+        :returns: False if either task isn't scheduled, or the dependency would make a cycle.
+        """
+        if before not in self.tasks or after not in self.tasks or before == after:
+            return False
+        if after not in self._succs[before] and self._position[before] > self._position[after]:
+            if not self._reorder(before, after):
+                return False
+            self._order = None
+
+        self._succs[before][after] = lag
+        self._preds[after][before] = lag
+        self._dirty_forward.add(after)
+        self._dirty_backward.add(before)
+        return True
+
+    def remove_dependency(self, before, after):
+        if after in self._succs.get(before, {}):
+            self._succs[before].pop(after)
+            self._preds[after].pop(before)
+            self._dirty_forward.add(after)
+            self._dirty_backward.add(before)
+
+    def _reorder(self, before, after):
+        """
+        Fix the topological order for a new dependency against it, only moving the tasks between the two
+        (Pearce and Kelly's algorithm).
+
+        :returns: False if `before` can be reached from `after`, the dependency would make a cycle.
+        """
+        lower, upper = self._position[after], self._position[before]
+
+        forward = {after}
+        stack = [after]
+        while stack:
+            for succ in self._succs[stack.pop()]:
+                if succ == before:
+                    return False
+                if succ not in forward and self._position[succ] < upper:
+                    forward.add(succ)
+                    stack.append(succ)
+
+        backward = {before}
+        stack = [before]
+        while stack:
+            for pred in self._preds[stack.pop()]:
+                if pred not in backward and self._position[pred] > lower:
+                    backward.add(pred)
+                    stack.append(pred)
+
+        moved = sorted(backward, key=self._position.get) + sorted(forward, key=self._position.get)
+        positions = sorted(self._position[name] for name in moved)
+        for name, position in zip(moved, positions):
+            self._position[name] = position
+        return True
+
+    def set_dates(self, name, start=None, end=None):
+        """ change the dates of a task, only the tasks depending on it are rescheduled. """
+        task = self.tasks[name]
+        if start is not None:
+            task.start = start
+        if end is not None:
+            task.end = end
+        self._release[name] = task.start.toordinal()
+        self._duration[name] = task.duration()
+        self._dirty_forward.add(name)
+        self._dirty_backward.add(name)
+
+    def topological_order(self):
+        """ names of the tasks, each after every task it depends on. """
+        if self._order is None:
+            self._order = sorted(self._position.keys(), key=self._position.get)
+        return self._order
+
+    def _visit(self, dirty, reverse=False):
+        """
+        Visit tasks in topological order (reversed for the backward pass), starting with the dirty ones.
+
+        :returns: (iterator of names, function queueing another task to visit). Tasks can only queue tasks
+            after them in the order. When most tasks are dirty the whole order is scanned, otherwise only
+            the queued tasks are, through a heap.
+        """
+        queued = set(dirty)
+        if len(queued) * 4 > len(self.tasks):
+            order = self.topological_order()
+            return (name for name in (reversed(order) if reverse else order) if name in queued), queued.add
+
+        position = self._position
+        sign = -1 if reverse else 1
+        heap = [(sign * position[name], name) for name in queued]
+        heapq.heapify(heap)
+
+        def queue(name):
+            if name not in queued:
+                queued.add(name)
+                heapq.heappush(heap, (sign * position[name], name))
+
+        def visit():
+            while heap:
+                yield heapq.heappop(heap)[1]
+
+        return visit(), queue
+
+    def recompute(self):
+        """ bring the earliest and latest starts up to date with the changes since the last call. """
+        duration = self._duration
+
+        # forward pass, earliest starts. a task only changes if a task before it finishes at another time.
+        visit, queue = self._visit(self._dirty_forward)
+        self._dirty_forward = set()
+        moved_projects = set()  # projects whose finish moved
+        for name in visit:
+            es = self._release[name]
+            for pred, lag in self._preds[name].items():
+                es = max(es, self._ef[pred] + lag)
+
+            self._es[name] = es
+            ef = es + duration[name]
+            old_ef = self._ef.get(name, None)
+            if ef == old_ef:
+                continue
+            self._ef[name] = ef
+
+            project = self.tasks[name].project
+            horizon = self._horizon.get(project, None)
+            if horizon is None or ef > horizon:
+                self._horizon[project] = ef
+                self._stale_projects.discard(project)
+                moved_projects.add(project)
+            elif old_ef == horizon:
+                self._stale_projects.add(project)
+
+            for succ in self._succs[name]:
+                queue(succ)
+
+        for project in self._stale_projects:
+            names = self._project_tasks.get(project, ())
+            horizon = max((self._ef[name] for name in names), default=None)
+            if horizon is None:
+                self._horizon.pop(project, None)
+                self._project_tasks.pop(project, None)
+            elif horizon != self._horizon.get(project, None):
+                self._horizon[project] = horizon
+                moved_projects.add(project)
+        self._stale_projects.clear()
+
+        # the last tasks of a project that finishes at another time can start at another time too.
+        for project in moved_projects:
+            self._dirty_backward.update(name for name in self._project_tasks.get(project, ()) if not self._succs[name])
+
+        # backward pass, latest starts. a task only changes if a task after it must start at another time.
+        visit, queue = self._visit(self._dirty_backward, reverse=True)
+        self._dirty_backward = set()
+        for name in visit:
+            succs = self._succs[name]
+            if succs:
+                lf = min(self._ls[succ] - lag for succ, lag in succs.items())
+            else:
+                lf = self._horizon[self.tasks[name].project]
+            ls = lf - duration[name]
+            if ls == self._ls.get(name, None):
+                continue
+            self._ls[name] = ls
+            for pred in self._preds[name]:
+                queue(pred)
+
+    def earliest_start(self, name):
+        self.recompute()
+        return date.fromordinal(self._es[name])
+
+    def latest_start(self, name):
+        self.recompute()
+        return date.fromordinal(self._ls[name])
+
+    def slack(self, name):
+        """ days a task can slip without delaying its project. """
+        self.recompute()
+        return self._ls[name] - self._es[name]
+
+    def project_end(self, project=None):
+        self.recompute()
+        return date.fromordinal(self._horizon[project])
+
+    def write(self, file=None):
+        """ write every task to a file (stdout by default) in topological order, streamed task by task. """
+        text_layout.write_blocks((self.tasks[name] for name in self.topological_order()), file)
+
+    def critical_tasks(self, project=None):
+        """ tasks of a project without slack, in topological order. """
+        self.recompute()
+        names = self._project_tasks.get(project, set())
+        return [name for name in self.topological_order() if name in names and self._ls[name] == self._es[name]]
+
+    def critical_path(self, project=None):
+        """ names of a chain of critical tasks ending with the last critical task of a project, first task first. """
+        self.recompute()
+
+        def critical(name):
+            return self._ls[name] == self._es[name]
 
-    def schedule_task(self, task: Task) -> bool:
-        self.tasks.append(task)
+        # usually the task finishing the project, unless it leads into a later project.
+        last = [name for name in self._project_tasks.get(project, ()) if critical(name)]
+        if not last:
+            return []
+        name = max(last, key=self._ef.get)
+        path = [name]
+        while True:
+            es = self._es[name]
+            name = next((pred for pred, lag in self._preds[name].items()
+                         if critical(pred) and self._ef[pred] + lag == es), None)
+            if name is None:
+                break
+            path.append(name)
+        path.reverse()
+        return path
 
 
 if __name__ == '__main__':
@@ -0,0 +1,72 @@
+"""
+Text layout of tasks for the command line and the GUI.
+
+Descriptions are word wrapped and hyphenated in a single pass over their words. Each task's rendered
+block is cached by the task's contents, so it is rendered again only after the task changes, and a
+schedule is streamed out block by block instead of being joined into one string.
+"""
+import functools
+import sys
+
+DESCRIPTION_WIDTH = 40
+DATE_FORMAT = "%Y / %m / %d"
+
+
+def wrap(text, width=DESCRIPTION_WIDTH):
+    """
+    Lines of text wrapped to a width, in one pass over its words.
+
+    A word that doesn't fit is hyphenated onto the end of the line if the line has at least 3 free
+    characters, and carries on on the next line.
+    """
+    line = []
+    line_len = 0  # length of " ".join(line)
+    for word in text.split(" "):
+        if line_len + len(word) + 1 > width:
+            if line_len < width - 3:
+                # hyphenate
+                ll = width - line_len - 1
+                line.append(word[:ll] + "-")
+                word = word[ll:]
+
+            yield " ".join(line)
+            line = [word]
+            line_len = len(word)
+        else:
+            line_len += len(word) + (1 if line else 0)
+            line.append(word)
+
+    yield " ".join(line)
+
+
+@functools.lru_cache(maxsize=16384)
+def render_block(name, description, start, end=None, width=DESCRIPTION_WIDTH):
+    """ text of a task: its name, dates, an underline and the wrapped description. """
+    dates = start.strftime(DATE_FORMAT)
+    if end is not None:
+        dates += " --- " + end.strftime(DATE_FORMAT)
+    return "\n".join([name, dates, "-" * len(name), *wrap(description, width)])
+
+
+def task_block(task, width=DESCRIPTION_WIDTH):
+    """ text of a task, rendered again only if the task changed since it was last rendered. """
+    return render_block(task.name, task.description, task.start, task.end, width)
+
+
+def iter_blocks(tasks, width=DESCRIPTION_WIDTH):
+    """ text of each task, one at a time, for the GUI to draw as it goes. """
+    for task in tasks:
+        yield task_block(task, width)
+
+
+def write_blocks(tasks, file=None, width=DESCRIPTION_WIDTH, separator="\n\n"):
+    """ write the text of many tasks to a file (stdout by default) without joining it all in memory. """
+    file = sys.stdout if file is None else file
+    first = True
+    for block in iter_blocks(tasks, width):
+        if not first:
+            file.write(separator)
+        file.write(block)
+        first = False
+    if not first:
+        file.write("\n")
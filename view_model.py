@@ -0,0 +1,138 @@
+"""
+Retained state of the GUI panels, kept between frames.
+
+Panels are rebuilt only when something they show changed:
+ - the database changed, either through invalidate() after a registration / removal in the GUI, or a
+   write from another connection or process, noticed through PRAGMA data_version.
+ - the status cache has new status bits for a project.
+A frame where nothing changed reads only from memory; other panels can use throttled() to poll the system
+at most once every poll_interval.
+"""
+import os
+import re
+import time
+
+from database_api import DatabaseObject, DataVersionWatcher
+from git_status import format_age
+from project_config import load_configs, settings_text
+
+
+def upstream_text(vcs_upstream):
+    """ short description of a project's upstream for the project list. """
+    if vcs_upstream is None:
+        return "Local"
+    pattern = re.compile(r"https://github.com/([^/]+)/([^/]+)\.git")
+    match = re.match(pattern, vcs_upstream)
+    if match is not None:
+        return "{" + f"GitHub->{match.group(2)}" + "}"
+    return vcs_upstream
+
+
+def status_text(status, age):
+    if status is None:
+        return " (...)"
+    status = f" ({status})" if status else ""
+    return status + f" [{format_age(age)} ago]"
+
+
+class PanelViewModel:
+    """
+    Project rows and rendered panel text of the GUI, retained between frames.
+
+    Call update() once per frame; the database is only polled for changes every `poll_interval` seconds,
+    and only re-read when it changed.
+    """
+    def __init__(self, file, status_cache=None, poll_interval=1.0):
+        self.file = file
+        self.status_cache = status_cache
+        self.poll_interval = poll_interval
+
+        self.dirty = True
+        self.categories = {}
+        self.project_rows = []
+        self.dbo_text = ""
+
+        self._buttons = []  # (location, button lines without the status line)
+        self._project_list = []  # (location, button text)
+        self._project_list_key = None  # (status cache version, age tick) the project list was built at
+
+        self._db_watcher = DataVersionWatcher(file)
+        self._last_poll = float('-inf')
+        self._throttled = {}  # name -> (time computed, value)
+
+    def invalidate(self):
+        """ rebuild the panels on the next update, eg. after registering or removing a project. """
+        self.dirty = True
+
+    def throttled(self, name, compute, interval=None):
+        """ value of compute(), recomputed at most once every `interval` seconds (poll_interval by default). """
+        interval = self.poll_interval if interval is None else interval
+        now = time.monotonic()
+        computed, value = self._throttled.get(name, (float('-inf'), None))
+        if now - computed >= interval:
+            value = compute()
+            self._throttled[name] = (now, value)
+        return value
+
+    def _poll_data_version(self):
+        """ mark the panels dirty if another connection committed to the database since the last poll. """
+        now = time.monotonic()
+        if now - self._last_poll < self.poll_interval:
+            return
+        self._last_poll = now
+
+        if self._db_watcher.changed():
+            self.dirty = True
+
+    def update(self):
+        """
+        Bring the panels up to date, reading the database only if it changed.
+
+        :returns: True if the panels were rebuilt.
+        """
+        self._poll_data_version()
+        if not self.dirty:
+            return False
+
+        with DatabaseObject(self.file) as dbo:
+            self.categories = dbo.get_categories()
+            self.project_rows = dbo.get_projects()
+            self.dbo_text = str(dbo)
+
+        configs = load_configs([project_row['project_location'] for project_row in self.project_rows])
+
+        self._buttons = []
+        for project_row in self.project_rows:
+            loc = project_row['project_location']
+            lines = [
+                self.categories.get(project_row['category_id'], "-") + ": " + project_row['project_name'],
+                f"\t~/{os.path.relpath(loc, os.path.expanduser('~'))}",
+                f"\tUpstream: {upstream_text(project_row['vcs_upstream'])}",
+            ]
+            if configs.get(loc):
+                lines.insert(2, f"\tSettings: {settings_text(configs[loc])}")
+            self._buttons.append((loc, lines))
+        if self.status_cache is not None:
+            self.status_cache.set_locations([loc for loc, _ in self._buttons])
+
+        self._project_list_key = None
+        self.dirty = False
+        return True
+
+    def project_list(self):
+        """
+        (location, button text) of each project, with the status from the status cache.
+
+        The text is rebuilt when the status cache changes, and once a second for the age of the statuses.
+        """
+        version = None if self.status_cache is None else self.status_cache.version
+        key = (version, int(time.monotonic()))
+        if key == self._project_list_key:
+            return self._project_list
+
+        self._project_list = []
+        for loc, lines in self._buttons:
+            status = "" if self.status_cache is None else status_text(*self.status_cache.get(loc))
+            self._project_list.append((loc, "\n".join(lines[:-1] + [lines[-1] + status])))
+        self._project_list_key = key
+        return self._project_list